@@ -0,0 +1,281 @@
+"""
+Benchmark suite for pricing throughput, greek latency, accuracy per CPU second, analytical pricers and baskets.
+
+    python -m benchmarks.suite [--quick] [--output PATH] [--compare PATH]
+
+Every case reports the first call, which includes tracing and compilation, separately from the median of the
+following calls. Results are written as JSON, by default to benchmarks/results/<commit>.json, so that two commits can
+be compared with --compare
+"""
+from typing import Dict, List, Callable, Optional, Type, Tuple, Any
+from dataclasses import dataclass, field, asdict
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import numpy
+import jax as jx
+import jax.numpy as np
+from scipy.stats import norm
+
+from flexpricer.model import Model, BlackScholes, ArithmeticBlackScholes, Heston, MultiAssetBlackScholes
+from flexpricer.instrument import Vanilla, Basket
+from flexpricer.engine import Pricer
+from flexpricer.analytical import price_bs_call, price_call_with_phi, price_calls_with_fft, BlackScholesPhi, \
+    HestonPhi
+from flexpricer import analytical_jax
+from flexpricer.analytical_bs import implied_vol
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+HESTON = {'v0': 0.04, 'vbar': 0.04, 'kappa': 1.5, 'eta': 0.5, 'rho': -0.7}
+BASE = {'spot': 100.0, 'rate': 0.02, 'dividend': 0.01, 'volatility': 0.2, 'expiration': 1.0, 'strike': 100.0,
+        'smooth': 0.01}
+
+
+@dataclass
+class ModelCase:
+    model: Type[Model]
+    params: Dict[str, float]
+    names: Tuple[str, ...]  # First order greeks
+    analytic: Callable[[numpy.ndarray], numpy.ndarray]  # Exact call prices over strikes
+
+
+def _bachelier_calls(strikes: numpy.ndarray) -> numpy.ndarray:
+    """ ArithmeticBlackScholes has no rate or dividend and normal vol volatility * spot """
+    deviation = BASE['volatility'] * BASE['spot'] * numpy.sqrt(BASE['expiration'])
+    moneyness = (BASE['spot'] - strikes) / deviation
+    return (BASE['spot'] - strikes) * norm.cdf(moneyness) + deviation * norm.pdf(moneyness)
+
+
+MODELS = {
+    'black_scholes': ModelCase(BlackScholes, BASE, ('spot', 'volatility'), lambda strikes: price_bs_call(
+        BASE['spot'], strikes, BASE['rate'], BASE['dividend'], BASE['volatility'], BASE['expiration'])),
+    'arithmetic_black_scholes': ModelCase(ArithmeticBlackScholes, BASE, ('spot', 'volatility'), _bachelier_calls),
+    'heston': ModelCase(Heston, {**BASE, **HESTON}, ('spot', 'v0'), lambda strikes: numpy.array([
+        price_call_with_phi(HestonPhi, BASE['spot'], strike, BASE['rate'], BASE['dividend'], BASE['expiration'],
+                            HESTON) for strike in strikes])),
+}
+
+
+@dataclass
+class SuiteConfig:
+    path_counts: Tuple[int, ...] = (16384, 131072, 1048576)
+    strike_counts: Tuple[int, ...] = (1, 16, 128)
+    greek_paths: int = 65536
+    accuracy_paths: int = 131072
+    accuracy_strikes: int = 21
+    asset_counts: Tuple[int, ...] = (5, 20, 50)
+    asset_paths: int = 131072
+    repeats: int = 5
+
+
+QUICK = SuiteConfig(path_counts=(4096,), strike_counts=(4,), greek_paths=4096, accuracy_paths=4096,
+                    accuracy_strikes=5, asset_counts=(5,), asset_paths=4096, repeats=2)
+
+
+@dataclass
+class BenchmarkRecord:
+    group: str
+    name: str
+    settings: Dict[str, Any]
+    first_seconds: float  # First call, including tracing and compilation where there is any
+    steady_seconds: float  # Median wall time of later calls
+    cpu_seconds: float  # Median process CPU time of later calls
+    metrics: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def key(self) -> str:
+        return f'{self.group}/{self.name}/' + ','.join(f'{k}={v}' for k, v in sorted(self.settings.items()))
+
+
+def measure(fn: Callable[[], Any], repeats: int) -> Tuple[float, float, float, Any]:
+    """ Time the first call and the median of `repeats` later calls. Results are waited for before the clock stops """
+    start = time.perf_counter()
+    result = jx.block_until_ready(fn())
+    first = time.perf_counter() - start
+
+    walls, cpus = [], []
+    for _ in range(repeats):
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = jx.block_until_ready(fn())
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+    return first, statistics.median(walls), statistics.median(cpus), result
+
+
+def strike_grid(count: int) -> np.ndarray:
+    return np.linspace(80.0, 120.0, count) if count > 1 else np.array([BASE['strike']])
+
+
+def bench_pricing(config: SuiteConfig) -> List[BenchmarkRecord]:
+    """ Paths per second of the eager and the compiled pipeline """
+    records = []
+    for model_name, case in MODELS.items():
+        for num_paths in config.path_counts:
+            pricer = Pricer(case.model, Vanilla, num_paths=num_paths)
+            for name, fn in (('unit_price', pricer.unit_price), ('compiled_price', pricer.compiled_price)):
+                first, steady, cpu, _ = measure(lambda: fn(case.params, 0), config.repeats)
+                records.append(BenchmarkRecord('pricing', name, {'model': model_name, 'paths': num_paths}, first,
+                                               steady, cpu, {'paths_per_second': num_paths / steady}))
+    return records
+
+
+def bench_greeks(config: SuiteConfig) -> List[BenchmarkRecord]:
+    """ Latency of first and second order greek functions over strike vectors """
+    records = []
+    for model_name, case in MODELS.items():
+        pricer = Pricer(case.model, Vanilla, num_paths=config.greek_paths)
+        first_name = case.names[0]
+        functions = {
+            'd1': lambda: pricer.generate_d1_fn(case.params, list(case.names), 'strike', 0),
+            'd2': lambda: pricer.generate_d2_fn(case.params, first_name, first_name, 'strike', 0),
+        }
+        for num_strikes in config.strike_counts:
+            strikes = strike_grid(num_strikes)
+            settings = {'model': model_name, 'paths': config.greek_paths, 'strikes': num_strikes}
+            for name, build in functions.items():
+                greek_fn = build()
+                first, steady, cpu, _ = measure(lambda: greek_fn(strikes), config.repeats)
+                records.append(BenchmarkRecord('greeks', name, settings, first, steady, cpu))
+
+            first, steady, cpu, _ = measure(lambda: pricer.risk(case.params, list(case.names),
+                                                                [(first_name, first_name)], 'strike', strikes, 0),
+                                            config.repeats)
+            records.append(BenchmarkRecord('greeks', 'risk', settings, first, steady, cpu))
+    return records
+
+
+def bench_accuracy(config: SuiteConfig) -> List[BenchmarkRecord]:
+    """ Price RMSE against analytics over a strike vector. Efficiency is 1 / (RMSE^2 * CPU seconds) """
+    records = []
+    strikes = strike_grid(config.accuracy_strikes)
+    for model_name, case in MODELS.items():
+        exact = case.analytic(numpy.asarray(strikes))
+        pricer = Pricer(case.model, Vanilla, num_paths=config.accuracy_paths)
+        first, steady, cpu, result = measure(lambda: pricer.risk(case.params, [], [], 'strike', strikes, 0),
+                                             config.repeats)
+        rmse = float(numpy.sqrt(numpy.mean((numpy.asarray(result.price, dtype=float) - exact) ** 2)))
+        records.append(BenchmarkRecord('accuracy', 'risk',
+                                       {'model': model_name, 'paths': config.accuracy_paths,
+                                        'strikes': config.accuracy_strikes}, first, steady, cpu,
+                                       {'rmse': rmse, 'efficiency': 1 / (rmse ** 2 * max(cpu, 1e-9))}))
+    return records
+
+
+def bench_analytical(config: SuiteConfig) -> List[BenchmarkRecord]:
+    """ Characteristic function pricers, with errors against Black Scholes """
+    records = []
+    r, q, sig, t = BASE['rate'], BASE['dividend'], BASE['volatility'], BASE['expiration']
+    for num_strikes in config.strike_counts:
+        strikes = numpy.asarray(strike_grid(num_strikes))
+        exact = price_bs_call(BASE['spot'], strikes, r, q, sig, t)
+        pricers = {
+            'quad': lambda generator, params: numpy.array([
+                price_call_with_phi(generator, BASE['spot'], strike, r, q, t, params) for strike in strikes]),
+            'fft': lambda generator, params: price_calls_with_fft(generator, BASE['spot'], strikes, r, q, t, params),
+            'jax': lambda generator, params: analytical_jax.price_calls_with_phi(
+                generator, BASE['spot'], strikes, numpy.array([t]), r, q, params)[0],
+        }
+        for name, price in pricers.items():
+            for model_name, (generator, params) in {'black_scholes': (BlackScholesPhi, {'sig': sig}),
+                                                    'heston': (HestonPhi, HESTON)}.items():
+                first, steady, cpu, result = measure(lambda: price(generator, params), config.repeats)
+                metrics = {'strikes_per_second': num_strikes / steady}
+                if model_name == 'black_scholes':
+                    metrics['max_error'] = float(numpy.max(numpy.abs(numpy.asarray(result, dtype=float) - exact)))
+                records.append(BenchmarkRecord('analytical', name, {'model': model_name, 'strikes': num_strikes},
+                                               first, steady, cpu, metrics))
+
+        first, steady, cpu, result = measure(lambda: implied_vol(exact, BASE['spot'], strikes, r, q, t), config.repeats)
+        records.append(BenchmarkRecord('analytical', 'implied_vol', {'model': 'black_scholes', 'strikes': num_strikes},
+                                       first, steady, cpu, {'strikes_per_second': num_strikes / steady,
+                                                            'max_error': float(numpy.nanmax(numpy.abs(result - sig)))}))
+    return records
+
+
+def bench_assets(config: SuiteConfig) -> List[BenchmarkRecord]:
+    """ Equally weighted basket on equicorrelated assets. Innovations are cached so steady time is simulation """
+    records = []
+    for num_assets in config.asset_counts:
+        params = {**BASE, 'spot': np.full(num_assets, BASE['spot']), 'dividend': np.full(num_assets, BASE['dividend']),
+                  'volatility': np.full(num_assets, BASE['volatility']), 'weights': np.full(num_assets, 1 / num_assets),
+                  'correlation': np.asarray(0.5 * numpy.eye(num_assets) + 0.5)}
+        pricer = Pricer(MultiAssetBlackScholes, Basket, num_paths=config.asset_paths)
+        first, steady, cpu, _ = measure(lambda: pricer.compiled_price(params, 0), config.repeats)
+        throughput = num_assets * config.asset_paths / steady
+        records.append(BenchmarkRecord('assets', 'basket', {'assets': num_assets, 'paths': config.asset_paths}, first,
+                                       steady, cpu, {'asset_paths_per_second': throughput}))
+    return records
+
+
+SUITES = {'pricing': bench_pricing, 'greeks': bench_greeks, 'accuracy': bench_accuracy, 'analytical': bench_analytical,
+          'assets': bench_assets}
+
+
+def run_suite(config: SuiteConfig, groups: Optional[List[str]] = None) -> List[BenchmarkRecord]:
+    records = []
+    for group in groups or list(SUITES):
+        records.extend(SUITES[group](config))
+    return records
+
+
+def environment() -> Dict[str, str]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit or 'unknown', 'jax': jx.__version__, 'backend': jx.default_backend(),
+            'devices': str(jx.device_count()), 'machine': platform.machine(), 'python': platform.python_version()}
+
+
+def save(records: List[BenchmarkRecord], path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump({'environment': environment(), 'records': [asdict(record) for record in records]}, file, indent=1)
+
+
+def load(path: str) -> List[BenchmarkRecord]:
+    with open(path) as file:
+        return [BenchmarkRecord(**record) for record in json.load(file)['records']]
+
+
+def compare(records: List[BenchmarkRecord], baseline: List[BenchmarkRecord]) -> List[str]:
+    """ One line per benchmark present in both runs. Ratios above 1 mean the new run is slower """
+    previous = {record.key: record for record in baseline}
+    lines = []
+    for record in records:
+        if record.key not in previous:
+            continue
+        old = previous[record.key]
+        lines.append(f'{record.key:<80} steady x{record.steady_seconds / old.steady_seconds:6.2f}'
+                     f'  first x{record.first_seconds / old.first_seconds:6.2f}')
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--quick', action='store_true', help='Small sizes, for a smoke run')
+    parser.add_argument('--groups', nargs='*', choices=list(SUITES), help='Benchmark groups to run, default all')
+    parser.add_argument('--output', help='Result file, default benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', help='Earlier result file to compare against')
+    args = parser.parse_args()
+
+    records = run_suite(QUICK if args.quick else SuiteConfig(), args.groups)
+    for record in records:
+        metrics = '  '.join(f'{k}={v:.4g}' for k, v in record.metrics.items())
+        print(f'{record.key:<80} first {record.first_seconds:8.4f}s  steady {record.steady_seconds:8.4f}s  {metrics}')
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{environment()["commit"]}.json')
+    save(records, output)
+    print(f'Saved {len(records)} results to {output}')
+    if args.compare:
+        print('\n'.join(compare(records, load(args.compare))))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,13 @@
 This module host analytical solution of regular option pricing for the use of benchmarking
 """
 import abc
-from typing import TypeVar, Callable, Dict, Type
+from types import ModuleType
+from typing import TypeVar, Callable, Dict, Type, Tuple
 from dataclasses import dataclass, field
 import numpy as np
 from scipy.stats import norm
 import scipy.integrate as integrate
+from scipy.interpolate import CubicSpline
 
 from flexpricer.base_component import PricerComponent
 
@@ -30,8 +32,8 @@ def price_bs_put(s: float, k: float, r: float, q: float, sig: float, t: float) -
 class PhiGenerator(PricerComponent, abc.ABC):
 
     @abc.abstractmethod
-    def generate(self) -> Callable[[complex], complex]:
-        """ Generate characteristic function """
+    def generate(self, xp: ModuleType = np) -> Callable[[complex], complex]:
+        """ Generate characteristic function. It evaluates with the array module xp, numpy or jax.numpy """
 
 
 @dataclass
@@ -41,9 +43,9 @@ class BlackScholesPhi(PhiGenerator):
     sig: float
     t: float
 
-    def generate(self) -> Callable[[complex], complex]:
+    def generate(self, xp: ModuleType = np) -> Callable[[complex], complex]:
         def phi(u: complex) -> complex:
-            return np.exp(- 0.5 * u * (u + 1j) * self.sig ** 2 * self.t)
+            return xp.exp(- 0.5 * u * (u + 1j) * self.sig ** 2 * self.t)
         return phi
 
 
@@ -57,21 +59,21 @@ class HestonPhi(PhiGenerator):
     eta: float  # vol of variance
     rho: float  # spot-variance correlation
 
-    def generate(self) -> Callable[[complex], complex]:
+    def generate(self, xp: ModuleType = np) -> Callable[[complex], complex]:
         eta2 = self.eta ** 2
 
         def phi(u: complex) -> complex:
             aa = -u ** 2 / 2 - 1j * u / 2
             bb = self.kappa - self.rho * self.eta * 1j * u
             cc = eta2 / 2
-            d = np.sqrt(bb ** 2 - 4 * aa * cc)
+            d = xp.sqrt(bb ** 2 - 4 * aa * cc)
             rp = (bb + d) / eta2
             rm = (bb - d) / eta2
             r_ratio = rm / rp
-            exp_d = np.exp(-d * self.t)
+            exp_d = xp.exp(-d * self.t)
             big_d = rm * (1 - exp_d) / (1 - r_ratio * exp_d)
-            big_c = self.kappa * (rm * self.t - 2 / eta2 * np.log((1 - r_ratio * exp_d) / (1 - r_ratio)))
-            return np.exp(big_c * self.vbar + big_d * self.v0)
+            big_c = self.kappa * (rm * self.t - 2 / eta2 * xp.log((1 - r_ratio * exp_d) / (1 - r_ratio)))
+            return xp.exp(big_c * self.vbar + big_d * self.v0)
 
         return phi
 
@@ -88,3 +90,35 @@ def price_call_with_phi(generator_cls: Type[PhiGenerator], s: float, k: float, r
     # noinspection PyTypeChecker
     integration = integrate.quad(wrapper, 0, 1000)
     return s * np.exp(-q * t) - np.sqrt(s * k) * np.exp(-(r + q) * t / 2) / np.pi * integration[0]
+
+
+def carr_madan_grid(phi: Callable[[complex], complex], alpha: float = 1.5, grid_size: int = 4096,
+                    spacing: float = 0.25) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Carr-Madan FFT of the damped call transform. phi is the characteristic function of log(S_T / F_T).
+    Return log-moneyness log(K / F_T) grid and undiscounted call prices in units of forward, i.e. E[(e^x - e^k)^+].
+    Log-moneyness spacing is 2 * pi / (grid_size * spacing)
+    """
+    v = spacing * np.arange(grid_size)
+    step = 2 * np.pi / (grid_size * spacing)
+    k = -grid_size * step / 2 + step * np.arange(grid_size)
+
+    # Simpson weights
+    weights = (3 + (-1) ** (np.arange(grid_size) + 1)) / 3
+    weights[0] = 1 / 3
+
+    psi = phi(v - (alpha + 1) * 1j) / (alpha ** 2 + alpha - v ** 2 + 1j * (2 * alpha + 1) * v)
+    transformed = np.fft.fft(np.exp(-1j * v * k[0]) * psi * spacing * weights)
+    return k, np.exp(-alpha * k) / np.pi * transformed.real
+
+
+def price_calls_with_fft(generator_cls: Type[PhiGenerator], s: float, strikes: np.ndarray, r: float, q: float,
+                         t: float, params: Dict[str, float], alpha: float = 1.5, grid_size: int = 4096,
+                         spacing: float = 0.25) -> np.ndarray:
+    """ Call prices for all strikes from one FFT. Prices are interpolated from the log-strike grid with a spline """
+    all_params = {**{'s': s, 'r': r, 'q': q, 't': t}, **params}
+    phi = generator_cls(**{k: all_params[k] for k in generator_cls.parameters()}).generate()
+    forward = s * np.exp((r - q) * t)
+    log_moneyness, prices = carr_madan_grid(phi, alpha, grid_size, spacing)
+    spline = CubicSpline(log_moneyness, prices)
+    return np.exp(-r * t) * forward * spline(np.log(np.asarray(strikes) / forward))
@@ -0,0 +1,83 @@
+"""
+Vectorized closed form Black Scholes prices and greeks, and a batch implied volatility solver. Every argument may be an
+array and arguments broadcast against each other
+"""
+from typing import Union
+from dataclasses import dataclass
+import numpy as np
+from scipy.special import ndtr
+
+ArrayT = Union[float, np.ndarray]
+
+# Halley steps of the implied vol solver. Four are enough for full double precision from the initial guess
+NUM_STEPS = 4
+# Smallest total volatility sigma * sqrt(t) the solver steps to
+MIN_TOTAL_VOL = 1e-8
+
+
+@dataclass
+class BlackScholesGreeks:
+    price: np.ndarray
+    delta: np.ndarray
+    gamma: np.ndarray
+    vega: np.ndarray
+    volga: np.ndarray  # d vega / d sig
+    vanna: np.ndarray  # d delta / d sig
+
+
+def bs_greeks(s: ArrayT, k: ArrayT, r: ArrayT, q: ArrayT, sig: ArrayT, t: ArrayT,
+              call: Union[bool, np.ndarray] = True) -> BlackScholesGreeks:
+    """ Price and greeks to spot and volatility. call selects calls or puts, per element when it is an array """
+    s, k, r, q, sig, t, call = np.broadcast_arrays(s, k, r, q, sig, t, call)
+    total_vol = sig * np.sqrt(t)
+    d1 = (np.log(s / k) + (r - q) * t) / total_vol + 0.5 * total_vol
+    d2 = d1 - total_vol
+    spot_discount = np.exp(-q * t)
+    strike_discount = np.exp(-r * t)
+    density = np.exp(-0.5 * d1 ** 2) / np.sqrt(2 * np.pi)
+
+    call_price = s * spot_discount * ndtr(d1) - k * strike_discount * ndtr(d2)
+    price = np.where(call, call_price, call_price - s * spot_discount + k * strike_discount)
+    delta = np.where(call, spot_discount * ndtr(d1), -spot_discount * ndtr(-d1))
+    gamma = spot_discount * density / (s * total_vol)
+    vega = s * spot_discount * density * np.sqrt(t)
+    return BlackScholesGreeks(price, delta, gamma, vega, vega * d1 * d2 / sig, -spot_discount * density * d2 / sig)
+
+
+def implied_vol(price: ArrayT, s: ArrayT, k: ArrayT, r: ArrayT, q: ArrayT, t: ArrayT,
+                call: Union[bool, np.ndarray] = True, num_steps: int = NUM_STEPS) -> np.ndarray:
+    """
+    Implied volatility of option prices, NaN where a price is outside the no-arbitrage bounds. Quotes are turned into
+    undiscounted out-of-the-money prices, the initial guess is the rational approximation of Corrado and Miller and a
+    fixed number of Halley steps are taken on the log price, which converges quickly also far out of the money
+    """
+    forward = s * np.exp((r - q) * t)
+    undiscounted = price * np.exp(r * t)
+    call_price = np.where(call, undiscounted, undiscounted + forward - k)
+    log_moneyness = np.log(forward / k)
+    otm_call = log_moneyness <= 0
+    target = np.where(otm_call, call_price, call_price - forward + k)
+    valid = (call_price > np.maximum(forward - k, 0)) & (call_price < forward) & (target > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        # Corrado Miller
+        excess = call_price - (forward - k) / 2
+        total_vol = np.sqrt(2 * np.pi) / (forward + k) * (
+            excess + np.sqrt(np.maximum(excess ** 2 - (forward - k) ** 2 / np.pi, 0)))
+        total_vol = np.maximum(total_vol, 1e-3)
+
+        log_target = np.log(target)
+        for _ in range(num_steps):
+            d1 = log_moneyness / total_vol + total_vol / 2
+            d2 = d1 - total_vol
+            otm_price = np.where(otm_call, forward * ndtr(d1) - k * ndtr(d2), k * ndtr(-d2) - forward * ndtr(-d1))
+            vega = forward * np.exp(-0.5 * d1 ** 2) / np.sqrt(2 * np.pi)
+
+            # Derivatives of log price to total vol
+            value = np.log(otm_price) - log_target
+            first = vega / otm_price
+            second = vega * d1 * d2 / (total_vol * otm_price) - first ** 2
+            total_vol = np.maximum(total_vol - value / first / (1 - value * second / (2 * first ** 2)),
+                                   MIN_TOTAL_VOL)
+
+    return np.where(valid, total_vol / np.sqrt(t), np.nan)
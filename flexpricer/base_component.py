@@ -1,11 +1,24 @@
-from typing import Tuple
-from dataclasses import dataclass, fields
+from typing import Tuple, Dict, Any
+from dataclasses import dataclass, fields, MISSING
 
 
 @dataclass
 class PricerComponent:
-    """ Base class that can be plugged into pricer. Both model and instrument subclass this """
+    """
+    Base class that can be plugged into pricer. Both model and instrument subclass this. Fields declared with
+    metadata={'static': True} are settings: plain Python values fixed when the pricer is built, which shape the trace
+    and are never traced themselves
+    """
 
     @classmethod
     def parameters(cls) -> Tuple[str, ...]:
-        return tuple(f.name for f in fields(cls) if f.init)
+        return tuple(f.name for f in fields(cls) if f.init and not f.metadata.get('static', False))
+
+    @classmethod
+    def settings(cls) -> Tuple[str, ...]:
+        return tuple(f.name for f in fields(cls) if f.init and f.metadata.get('static', False))
+
+    @classmethod
+    def defaults(cls) -> Dict[str, Any]:
+        """ Parameters that may be left out of params """
+        return {f.name: f.default for f in fields(cls) if f.name in cls.parameters() and f.default is not MISSING}
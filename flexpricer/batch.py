@@ -0,0 +1,170 @@
+"""
+Headless batch pricing of scenario files.
+
+    python -m flexpricer.batch scenarios.jsonl prices.csv --model BlackScholes --instrument Vanilla
+
+Records are read one at a time from JSONL or CSV. A record holds the model and instrument parameters, and may name its
+own model, instrument and id. Records are grouped by (model, instrument, schedule). Each group is priced by one
+compiled vmapped function in batches sized to a memory budget. Results are written as soon as a batch is done, so
+rows come out grouped rather than in input order, with the id (the record number by default) to join them back.
+Output is CSV, or Parquet for a .parquet path when pyarrow is installed
+"""
+from typing import Dict, Any, Iterator, Iterable, List, Optional, Tuple, Type
+import argparse
+import csv
+import json
+import math
+
+from flexpricer import model as models
+from flexpricer import instrument as instruments
+from flexpricer.model import Model
+from flexpricer.instrument import Instrument
+from flexpricer.engine import Pricer
+from flexpricer.compilation import CompileCache
+
+# Memory budget of one batch and the largest number of scenarios per batch
+BATCH_BYTES = 1 << 30
+MAX_BATCH_SIZE = 1024
+OUTPUT_COLUMNS = ('id', 'model', 'instrument', 'price')
+# Record fields that are not pricing parameters
+RESERVED = ('id', 'model', 'instrument')
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """ Records of a .csv file, or of a JSONL file otherwise. CSV values are converted to floats where possible """
+    with open(path, newline='') as file:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(file):
+                yield {k: _number(v) if k not in RESERVED else v for k, v in row.items()}
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _number(value: str) -> Any:
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+class ResultWriter:
+    """ Appends batches of rows to CSV, or to Parquet row groups """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.rows = 0
+        if path.endswith('.parquet'):
+            import pyarrow
+            import pyarrow.parquet
+            self._pyarrow = pyarrow
+            schema = pyarrow.schema([('id', pyarrow.string()), ('model', pyarrow.string()),
+                                     ('instrument', pyarrow.string()), ('price', pyarrow.float64())])
+            self._parquet = pyarrow.parquet.ParquetWriter(path, schema)
+            self._file = None
+        else:
+            self._parquet = None
+            self._file = open(path, 'w', newline='')
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(OUTPUT_COLUMNS)
+
+    def write(self, rows: List[Tuple[str, str, str, float]]) -> None:
+        if self._parquet is not None:
+            columns = list(zip(*rows))
+            self._parquet.write_table(self._pyarrow.table(
+                {name: list(column) for name, column in zip(OUTPUT_COLUMNS, columns)}, schema=self._parquet.schema))
+        else:
+            self._csv.writerows(rows)
+            self._file.flush()
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        if self._parquet is not None:
+            self._parquet.close()
+        else:
+            self._file.close()
+
+    def __enter__(self) -> 'ResultWriter':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class BatchRunner:
+    """ Groups records by compiled signature and prices each group in batches. Pricers share one compile cache """
+
+    def __init__(self, num_paths: int = 100000, seed: int = 0, max_bytes: int = BATCH_BYTES,
+                 model: Optional[str] = None, instrument: Optional[str] = None) -> None:
+        self.num_paths = num_paths
+        self.seed = seed
+        self.max_bytes = max_bytes
+        self.model = model
+        self.instrument = instrument
+        self.cache = CompileCache()
+        self._pricers: Dict[Tuple[Type[Model], Type[Instrument]], Pricer] = {}
+
+    def run(self, records: Iterable[Dict[str, Any]], writer: ResultWriter) -> int:
+        """ Price all records and return the number of rows written """
+        sizes: Dict[Any, int] = {}
+        pending: Dict[Any, Tuple[Pricer, List[Tuple[str, Dict[str, Any]]]]] = {}
+        for idx, record in enumerate(records):
+            pricer = self._pricer(record)
+            params = {k: v for k, v in record.items() if k not in RESERVED}
+            key = (pricer.model_class, pricer.instr_class, pricer.schedule_key(params))
+            if key not in sizes:
+                sizes[key] = self.batch_size(pricer, params)
+            _, group = pending.setdefault(key, (pricer, []))
+            group.append((str(record.get('id', idx)), params))
+            if len(group) == sizes[key]:
+                self._flush(pricer, pending.pop(key)[1], sizes[key], writer)
+
+        for key, (pricer, group) in pending.items():
+            self._flush(pricer, group, sizes[key], writer)
+        return writer.rows
+
+    def batch_size(self, pricer: Pricer, params: Dict[str, Any]) -> int:
+        """ Largest power of two number of scenarios within the memory budget """
+        model = pricer.initialized_model(params)
+        per_scenario = pricer.bytes_per_path(model, 0) * self.num_paths
+        return min(2 ** int(math.log2(max(self.max_bytes // per_scenario, 1))), MAX_BATCH_SIZE)
+
+    def _pricer(self, record: Dict[str, Any]) -> Pricer:
+        model_name = record.get('model', self.model)
+        instrument_name = record.get('instrument', self.instrument)
+        if model_name is None or instrument_name is None:
+            raise ValueError('Records must name a model and an instrument unless defaults are given')
+        key = (getattr(models, model_name), getattr(instruments, instrument_name))
+        if key not in self._pricers:
+            self._pricers[key] = Pricer(*key, num_paths=self.num_paths, cache=self.cache)
+        return self._pricers[key]
+
+    def _flush(self, pricer: Pricer, group: List[Tuple[str, Dict[str, Any]]], batch_size: int,
+               writer: ResultWriter) -> None:
+        # A partial batch is padded to the next power of two only, so that a lone record does not simulate a full batch
+        padded_size = min(2 ** math.ceil(math.log2(len(group))), batch_size)
+        prices = pricer.price_batch([params for _, params in group], self.seed, padded_size)
+        writer.write([(record_id, pricer.model_class.__name__, pricer.instr_class.__name__, float(price))
+                      for (record_id, _), price in zip(group, prices)])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Price a file of scenarios')
+    parser.add_argument('scenarios', help='JSONL or CSV file of scenarios')
+    parser.add_argument('output', help='CSV or Parquet output file')
+    parser.add_argument('--model', help='Model class for records that do not name one')
+    parser.add_argument('--instrument', help='Instrument class for records that do not name one')
+    parser.add_argument('--num-paths', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-bytes', type=float, default=BATCH_BYTES, help='Memory budget of one batch')
+    args = parser.parse_args()
+
+    runner = BatchRunner(args.num_paths, args.seed, int(args.max_bytes), args.model, args.instrument)
+    with ResultWriter(args.output) as writer:
+        count = runner.run(read_records(args.scenarios), writer)
+    print(f'Priced {count} scenarios into {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Calibrate Heston parameters to a quoted surface with the fixed node JAX pricer in flexpricer.analytical_jax
+"""
+from typing import Dict, Optional
+from dataclasses import dataclass, field
+import time
+import numpy
+import jax.numpy as np
+import jax as jx
+from scipy.optimize import least_squares
+
+from flexpricer.analytical import price_bs_call, HestonPhi
+from flexpricer.analytical_jax import phi_grid, price_calls_from_phi_grid, NUM_NODES, UPPER
+
+HESTON_NAMES = ('v0', 'vbar', 'kappa', 'eta', 'rho')
+HESTON_BOUNDS = ((1e-4, 1e-4, 1e-3, 1e-3, -0.999), (2.0, 2.0, 20.0, 5.0, 0.999))
+HESTON_GUESS = (0.04, 0.04, 1.0, 0.5, -0.5)
+
+
+@dataclass
+class Surface:
+    """ One call quote per entry. Quotes are prices or Black Scholes implied vols """
+    strikes: numpy.ndarray
+    maturities: numpy.ndarray
+    quotes: numpy.ndarray
+    weights: Optional[numpy.ndarray] = None
+    quote_type: str = 'price'
+
+    def prices(self, s: float, r: float, q: float) -> numpy.ndarray:
+        if self.quote_type == 'price':
+            return numpy.asarray(self.quotes, dtype=float)
+        if self.quote_type == 'vol':
+            return price_bs_call(s, numpy.asarray(self.strikes), r, q, numpy.asarray(self.quotes),
+                                 numpy.asarray(self.maturities))
+        raise ValueError(f'Unknown quote type {self.quote_type}')
+
+
+@dataclass
+class CalibrationResult:
+    params: Dict[str, float]
+    rmse: float  # Weighted price RMSE
+    iterations: int  # Jacobian evaluations
+    evaluations: int  # Residual evaluations
+    seconds: float
+    success: bool
+
+
+@dataclass
+class HestonCalibrator:
+    """
+    Least squares fit of (v0, vbar, kappa, eta, rho) with a trust region optimizer and exact Jacobians. phi only
+    depends on maturity so it is evaluated once per distinct maturity and shared by all strikes of that maturity.
+    Each call warm starts from the previous solution
+    """
+    s: float
+    r: float
+    q: float
+    num_nodes: int = NUM_NODES
+    upper: float = UPPER
+    tolerance: float = 1e-8
+
+    _previous: Optional[numpy.ndarray] = field(default=None, init=False, repr=False)
+
+    def calibrate(self, surface: Surface, initial: Optional[Dict[str, float]] = None) -> CalibrationResult:
+        start = time.perf_counter()
+        maturities, maturity_index = numpy.unique(numpy.asarray(surface.maturities, dtype=float), return_inverse=True)
+        weights = numpy.ones(len(surface.quotes)) if surface.weights is None else numpy.asarray(surface.weights)
+        data = (self.s, self.r, self.q, maturities, maturity_index, numpy.asarray(surface.strikes, dtype=float),
+                surface.prices(self.s, self.r, self.q), weights)
+        static = {'num_nodes': self.num_nodes, 'upper': self.upper}
+
+        def residual_fn(x: numpy.ndarray) -> numpy.ndarray:
+            return numpy.asarray(_residuals(x, *data, **static), dtype=float)
+
+        def jacobian_fn(x: numpy.ndarray) -> numpy.ndarray:
+            return numpy.asarray(_jacobian(x, *data, **static), dtype=float)
+
+        if initial is not None:
+            x0 = numpy.array([initial[name] for name in HESTON_NAMES])
+        elif self._previous is not None:
+            x0 = self._previous
+        else:
+            x0 = numpy.array(HESTON_GUESS)
+        x0 = numpy.clip(x0, *HESTON_BOUNDS)
+
+        solution = least_squares(residual_fn, x0, jac=jacobian_fn, bounds=HESTON_BOUNDS, method='trf', x_scale='jac',
+                                 ftol=self.tolerance, xtol=self.tolerance, gtol=self.tolerance)
+        self._previous = solution.x
+        rmse = float(numpy.sqrt(numpy.sum(solution.fun ** 2) / numpy.sum(weights ** 2)))
+        return CalibrationResult(dict(zip(HESTON_NAMES, solution.x.tolist())), rmse, int(solution.njev),
+                                 int(solution.nfev), time.perf_counter() - start, bool(solution.success))
+
+
+def heston_residuals(x: np.ndarray, s: float, r: float, q: float, maturities: np.ndarray, maturity_index: np.ndarray,
+                     strikes: np.ndarray, prices: np.ndarray, weights: np.ndarray, num_nodes: int = NUM_NODES,
+                     upper: float = UPPER) -> np.ndarray:
+    """ Weighted price residuals for x = (v0, vbar, kappa, eta, rho). maturity_index maps quotes to maturities """
+    phis = phi_grid(HestonPhi, maturities, dict(zip(HESTON_NAMES, x)), num_nodes, upper)
+    model = price_calls_from_phi_grid(phis[maturity_index], s, strikes, maturities[maturity_index], r, q, num_nodes,
+                                      upper)
+    return weights * (model - prices)
+
+
+# Compiled once per surface shape and reused across calibrations
+_residuals = jx.jit(heston_residuals, static_argnames=('num_nodes', 'upper'))
+_jacobian = jx.jit(jx.jacfwd(heston_residuals), static_argnames=('num_nodes', 'upper'))
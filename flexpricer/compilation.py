@@ -0,0 +1,57 @@
+"""
+Cache of compiled pricing executables. Executables are keyed on everything that is static to a trace so that
+repeated calls with new parameter values do not retrace
+"""
+from typing import Tuple, Dict, Callable, NamedTuple, Type, Any, Optional
+from collections import defaultdict
+
+from flexpricer.model.base_model import ScheduleLayout
+
+
+class CompiledSignature(NamedTuple):
+    model: Type
+    instrument: Type
+    schedule: Tuple[float, ...]
+    layout: ScheduleLayout
+    num_paths: int
+    dtype: str
+    precision: Optional[Any] = None  # Precision policy that path averages were traced with
+    segment_length: Optional[int] = None  # Checkpointed steps per segment of the simulation
+    settings: Tuple[Tuple[str, Any], ...] = ()  # Static fields of the components, see PricerComponent
+
+
+class CompileCache:
+
+    def __init__(self) -> None:
+        self._executables: Dict[Any, Callable] = {}
+        self._traces: Dict[Any, int] = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        self.retraces = 0
+
+    def get(self, key: Any, build: Callable[[Callable[[], None]], Callable], variant: Any = None) -> Callable:
+        """
+        Return the executable for `key` and `variant`, building it on a miss. Variants of a key are executables
+        compiled ahead of time for different argument shapes. `build` receives a callback that the traced function
+        should call at trace time, so that every trace of a key after its first counts as a retrace, whether a jitted
+        function traced again or another variant was built
+        """
+        if (key, variant) in self._executables:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._executables[key, variant] = build(lambda: self._record_trace(key))
+        return self._executables[key, variant]
+
+    def _record_trace(self, key: Any) -> None:
+        self._traces[key] += 1
+        if self._traces[key] > 1:
+            self.retraces += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'retraces': self.retraces, 'size': len(self._executables)}
+
+    def clear(self) -> None:
+        self._executables.clear()
+        self._traces.clear()
+        self.hits = self.misses = self.retraces = 0
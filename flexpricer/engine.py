@@ -1,52 +1,483 @@
-from typing import Dict, Type, List, Tuple, Callable
+from typing import Dict, Type, List, Tuple, Callable, Optional, Any
+import numpy
 import jax.numpy as np
 import jax as jx
 import time
-from plotly.subplots import make_subplots
-import plotly.graph_objects as go
+import math
+import functools
+from dataclasses import dataclass, field
 
-from flexpricer.model import Model
+from flexpricer.base_component import PricerComponent
+from flexpricer.model import Model, InnovationSource, PseudoRandom, Antithetic, InnovationCache
+from flexpricer.model.base_model import ScheduleLayout
 from flexpricer.instrument import Instrument
+from flexpricer.instrument.base_instrument import ForwardActionT, BackwardActionT
+from flexpricer.compilation import CompileCache, CompiledSignature
+from flexpricer.sharding import shard_paths, check_paths
+from flexpricer.precision import Precision, SINGLE
+from flexpricer.persistence import ExportStore, argument_key
+from flexpricer.instrumentation import Instrumentation, DISABLED, phase, scope as instrumented
+
+# Paths per independently seeded block in streaming mode. Blocks and chunks are made of whole seed blocks
+STREAM_SEED_SIZE = 1024
+# Paths evaluated together in streaming mode without a memory budget
+STREAM_BLOCK_SIZE = 65536
+# Allowance for model state and intermediates per step, in units of one float, when sizing blocks from a memory budget
+STREAM_STATE_SIZE = 8
+
+
+def _scoped(method: Callable) -> Callable:
+    """
+    Run a pricer method, including any tracing and compilation it triggers, under the pricer's precision and with
+    phases reported to its instrumentation
+    """
+    @functools.wraps(method)
+    def wrapper(self: 'Pricer', *args, **kwargs):
+        with self.precision.scope(), instrumented(self.instrumentation):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+@dataclass
+class RiskResult:
+    """ Greeks over the vector axis. Second order greeks are keyed by the pair of parameter names """
+    price: np.ndarray
+    first_order: Dict[str, np.ndarray]
+    second_order: Dict[Tuple[str, str], np.ndarray]
+
+
+@dataclass
+class ControlVariate:
+    """
+    Companion instrument priced on the same paths, with its exact price given the full parameter dict with the control
+    overrides applied. Only the priced instrument can carry path statistics
+    """
+    instrument: Type[Instrument]
+    expectation: Callable[[Dict[str, float]], float]
+    params: Dict[str, float] = field(default_factory=dict)  # Overrides of the pricing parameters
+
+
+@dataclass
+class VarianceReport:
+    price: float
+    std_error: float
+    plain_std_error: float  # Estimated standard error without antithetics or control variate
+    variance_reduction: float
+    beta: Optional[float]  # Control variate coefficient
 
 
 class Pricer:
 
-    def __init__(self, model: Type[Model], instrument: Type[Instrument], num_paths: int = 100000) -> None:
+    def __init__(self, model: Type[Model], instrument: Type[Instrument], num_paths: int = 100000,
+                 cache: Optional[CompileCache] = None, innovations: Optional[InnovationSource] = None,
+                 antithetic: bool = False, control_variate: Optional[ControlVariate] = None,
+                 num_batches: int = 32, shard: bool = False,
+                 innovation_cache: Optional[InnovationCache] = None, precision: Precision = SINGLE,
+                 instrumentation: Instrumentation = DISABLED, store: Optional[ExportStore] = None,
+                 segment_length: Optional[int] = None, settings: Optional[Dict[str, Any]] = None) -> None:
         self.model_class = model
         self.instr_class = instrument
         self.num_paths = num_paths
+        self.cache = CompileCache() if cache is None else cache
+        self.innovations = PseudoRandom() if innovations is None else innovations
+        if antithetic:
+            self.innovations = Antithetic(self.innovations)
+        self.control_variate = control_variate
+        self.num_batches = num_batches
+        self.shard = shard
+        if shard:
+            check_paths(num_paths)
+        # Greek functions and scenario sweeps reuse the innovations of a seed instead of drawing them again
+        self.innovation_cache = InnovationCache() if innovation_cache is None else innovation_cache
+        self.precision = precision
+        self.instrumentation = instrumentation
+        # Exported compiled_price and risk functions are loaded from here instead of traced, see persistence
+        self.store = store
+        # Rematerialize the simulation in segments of this many steps when differentiating, see scan_steps
+        self.segment_length = segment_length
+        # Static fields of the components such as the number of exercise dates, see PricerComponent
+        self.settings = {} if settings is None else dict(settings)
+        unknown = set(self.settings) - set(model.settings() + instrument.settings())
+        if unknown:
+            raise ValueError(f'Unknown settings {sorted(unknown)} for {model.__name__} and {instrument.__name__}')
 
-    def unit_price(self, params: Dict[str, float], seed: int) -> float:
+    def _build(self, params: Dict[str, float]) -> Tuple[Model, Instrument]:
         # noinspection PyArgumentList
-        model = self.model_class(**{k: params[k] for k in self.model_class.parameters()})
+        model = self.model_class(**self._arguments(self.model_class, params))
         # noinspection PyArgumentList
-        instrument = self.instr_class(**{k: params[k] for k in self.instr_class.parameters()})
+        instrument = self.instr_class(**self._arguments(self.instr_class, params))
+        return model, instrument
+
+    def _arguments(self, component: Type[PricerComponent], params: Dict[str, float]) -> Dict[str, Any]:
+        """ Parameters of `component`, with defaults for those left out, and its settings """
+        all_params = {**component.defaults(), **params}
+        settings = {k: v for k, v in self.settings.items() if k in component.settings()}
+        return {**{k: all_params[k] for k in component.parameters()}, **settings}
+
+    @_scoped
+    def unit_price(self, params: Dict[str, float], seed: int) -> float:
+        with phase('initialize'):
+            model, instrument = self._build(params)
+
+            # Retrieve events and initialize model
+            forward_events = instrument.build_forward_events()
+            backward_events = instrument.build_backward_events()
+            model.initialize(forward_events, monitoring=instrument.monitoring_schedule())
+
+        # Generate paths
+        innovations = self.draw_innovations(model, seed)
+        with phase('simulate', paths=self.num_paths) as simulation:
+            grids = simulation.ready(model.simulate(innovations, self.segment_length, instrument.path_statistics()))
+        with phase('events') as events:
+            return events.ready(run_events(forward_events, backward_events, grids))
+
+    @_scoped
+    def compiled_price(self, params: Dict[str, float], seed: int) -> float:
+        """
+        Same as unit_price but the whole pipeline is traced once per signature and executed with jax.jit. Schedule
+        and component classes are static, parameter values are not
+        """
+        model = self.initialized_model(params)
+        innovations = self.draw_innovations(model, seed)
+        key = self._signature(model, self.num_paths, innovations.dtype)
+        args = (self.select(params), innovations)
+        executable = self._executable(key, lambda on_trace: self._compile(model.layout, on_trace), args)
+        with phase('execute', method='compiled_price', paths=self.num_paths) as execution:
+            return execution.ready(executable(*args))
+
+    def price_batch(self, scenarios: List[Dict[str, float]], seed: int,
+                    batch_size: Optional[int] = None) -> numpy.ndarray:
+        """
+        Prices of many parameter sets in one vmapped compiled call on shared innovations. All scenarios must have the
+        schedule of the first one. Scenarios are padded to batch_size so that batches of any length up to it share
+        one executable
+        """
+        return self.risk_batch(scenarios, [], seed, batch_size)[0]
+
+    @_scoped
+    def risk_batch(self, scenarios: List[Dict[str, float]], names: List[str], seed: int,
+                   batch_size: Optional[int] = None) -> Tuple[numpy.ndarray, Dict[str, numpy.ndarray]]:
+        """ Same as price_batch, together with first order greeks of every scenario to `names` """
+        names = tuple(names)
+        batch_size = len(scenarios) if batch_size is None else batch_size
+        if not 0 < len(scenarios) <= batch_size:
+            raise ValueError(f'Expected between 1 and {batch_size} scenarios, got {len(scenarios)}')
+        model = self.initialized_model(scenarios[0])
+        for scenario in scenarios[1:]:
+            other = self.initialized_model(scenario)
+            if other.layout != model.layout or not numpy.array_equal(other.schedule, model.schedule):
+                raise ValueError('Scenarios of one batch must share their schedule, group them with schedule_key')
+
+        innovations = self.draw_innovations(model, seed)
+        padded = list(scenarios) + [scenarios[-1]] * (batch_size - len(scenarios))
+        selected = [self.select(scenario) for scenario in padded]
+        stacked = {k: self._stack([scenario[k] for scenario in selected]) for k in selected[0]}
+        args = ({k: stacked.pop(k) for k in names}, stacked, innovations)
+        signature = (self._signature(model, self.num_paths, innovations.dtype), 'batch', names, batch_size)
+        executable = self._executable(signature, lambda on_trace: self._compile_batch(model.layout, names, on_trace),
+                                      args)
+        with phase('execute', method='risk_batch', paths=self.num_paths, scenarios=len(scenarios)) as execution:
+            prices, greeks = execution.ready(executable(*args))
+        return (numpy.asarray(prices)[:len(scenarios)],
+                {name: numpy.asarray(greeks[name])[:len(scenarios)] for name in names})
+
+    def _compile_batch(self, layout: ScheduleLayout, names: Tuple[str, ...], on_trace: Callable[[], None]) -> Callable:
+
+        def one(sensitives: Dict[str, float], fixed: Dict[str, float], innovations: np.ndarray):
+            def price(x: Dict[str, float]) -> float:
+                return self.price_paths({**x, **fixed}, innovations, layout)
+            return jx.value_and_grad(price)(sensitives) if names else (price(sensitives), {})
+
+        def batch(sensitives: Dict[str, np.ndarray], fixed: Dict[str, np.ndarray], innovations: np.ndarray):
+            on_trace()
+            return jx.vmap(one, in_axes=(0, 0, None))(sensitives, fixed, innovations)
+
+        return jx.jit(batch)
+
+    def schedule_key(self, params: Dict[str, float]) -> Tuple:
+        """ Scenarios with equal keys can be priced together by price_batch """
+        model = self.initialized_model(params)
+        return tuple(numpy.asarray(model.schedule).tolist()), model.layout
+
+    @_scoped
+    def reduced_price(self, params: Dict[str, float], seed: int) -> VarianceReport:
+        """
+        Price with the configured variance reduction and report its effect. Paths are split into num_batches batches,
+        each priced on its own, and errors come from the spread of batch prices. With antithetics, each half of the
+        batch is also priced separately to estimate the plain error, and the control variate coefficient is regressed
+        across batches
+        """
+        antithetic = isinstance(self.innovations, Antithetic)
+        num_groups = 2 * self.num_batches if antithetic else self.num_batches
+        if self.num_paths % num_groups:
+            raise ValueError(f'num_paths {self.num_paths} is not a multiple of {num_groups} batches')
+
+        with phase('initialize'):
+            model, instrument = self._build(params)
+            control = self.control_variate
+            events = instrument.build_forward_events()
+            if control is not None:
+                events += self._build_control(params).build_forward_events()
+            model.initialize_schedule(tuple(event[0] for event in events), max(event[0] for event in events),
+                                      monitoring=instrument.monitoring_schedule())
+        with phase('generate', paths=self.num_paths) as generation:
+            innovations = generation.ready(model.generate_innovations(self.num_paths, seed, self.innovations,
+                                                                      self.innovation_cache, self.precision.dtype))
+
+        signature = (self._signature(model, self.num_paths, innovations.dtype), 'batches', num_groups,
+                     None if control is None else control.instrument)
+        control_params = {} if control is None else {k: {**params, **control.params}[k]
+                                                      for k in control.instrument.parameters()}
+        shape = innovations.shape[:2] + (num_groups, self.num_paths // num_groups)
+        args = (self.select(params), control_params, innovations.reshape(shape))
+        executable = self._executable(signature, lambda on_trace: self._compile_batches(model.layout, on_trace), args)
+        with phase('execute', method='reduced_price', paths=self.num_paths) as execution:
+            targets, controls = execution.ready(executable(*args))
+        targets = numpy.asarray(targets, dtype=float)
+
+        if antithetic:
+            # First half of the groups are the original paths, second half their mirrors
+            plain_variance = targets[:self.num_batches].var(ddof=1) / num_groups
+            targets = (targets[:self.num_batches] + targets[self.num_batches:]) / 2
+        else:
+            plain_variance = targets.var(ddof=1) / num_groups
+
+        beta = None
+        if control is not None:
+            controls = numpy.asarray(controls, dtype=float)
+            if antithetic:
+                controls = (controls[:self.num_batches] + controls[self.num_batches:]) / 2
+            covariance = numpy.cov(targets, controls)
+            beta = float(covariance[0, 1] / covariance[1, 1])
+            targets = targets - beta * (controls - control.expectation({**params, **control.params}))
+
+        variance = targets.var(ddof=1) / len(targets)
+        return VarianceReport(float(targets.mean()), float(numpy.sqrt(variance)), float(numpy.sqrt(plain_variance)),
+                              float(plain_variance / variance), beta)
+
+    def _build_control(self, params: Dict[str, float]) -> Instrument:
+        all_params = {**params, **self.control_variate.params}
+        # noinspection PyArgumentList
+        return self.control_variate.instrument(**{k: all_params[k]
+                                                  for k in self.control_variate.instrument.parameters()})
+
+    def _compile_batches(self, layout: ScheduleLayout, on_trace: Callable[[], None]) -> Callable:
+        control = self.control_variate
+
+        def batch_prices(params: Dict[str, float], control_params: Dict[str, float],
+                         innovations: np.ndarray) -> Tuple[float, Optional[float]]:
+            model, instrument = self._build(params)
+            events = [(instrument.build_forward_events(), instrument.build_backward_events())]
+            if control is not None:
+                # noinspection PyArgumentList
+                companion = control.instrument(**control_params)
+                events.append((companion.build_forward_events(), companion.build_backward_events()))
+
+            times = [event[0] for forward_events, _ in events for event in forward_events]
+            model.initialize_schedule(np.stack(times), np.max(np.stack(times)), layout,
+                                      instrument.monitoring_schedule())
+            grids = model.simulate(innovations, statistics=instrument.path_statistics())
+            prices = []
+            for forward_events, backward_events in events:
+                prices.append(run_events(forward_events, backward_events, grids[:len(forward_events)]))
+                grids = grids[len(forward_events):]
+            return prices[0], prices[1] if control is not None else None
+
+        def batches(params: Dict[str, float], control_params: Dict[str, float], innovations: np.ndarray):
+            on_trace()
+            return jx.vmap(batch_prices, in_axes=(None, None, 2))(params, control_params, innovations)
+
+        return jx.jit(batches)
+
+    @_scoped
+    def fit_exercise(self, params: Dict[str, float], seed: int) -> np.ndarray:
+        """
+        Exercise regression coefficients of an early exercise instrument, fitted on the paths of `seed`. Pass them as
+        the coefficients parameter and price with another seed to remove foresight bias
+        """
+        model, instrument = self._build({**params, 'coefficients': None})
+        forward_events = instrument.build_forward_events()
+        model.initialize(forward_events, monitoring=instrument.monitoring_schedule())
+        grids = model.simulate(self.draw_innovations(model, seed), statistics=instrument.path_statistics())
+        run_events(forward_events, instrument.build_backward_events(), grids)
+        return instrument.fitted_coefficients
+
+    def price_replicates(self, params: Dict[str, float], seeds: List[int]) -> Tuple[float, float]:
+        """ Mean and standard error over independent replicates, e.g. differently scrambled Sobol sequences """
+        prices = numpy.array([self.compiled_price(params, seed) for seed in seeds], dtype=float)
+        return float(prices.mean()), float(prices.std(ddof=1) / numpy.sqrt(len(prices)))
+
+    def stream_price(self, params: Dict[str, float], seed: int, chunk_size: Optional[int] = None,
+                     max_bytes: Optional[int] = None, block_size: Optional[int] = None) -> float:
+        """ Price with paths simulated block by block. See _stream """
+        return self._stream(params, (), seed, chunk_size, max_bytes, block_size)[0]
+
+    def stream_value_and_grad(self, params: Dict[str, float], names: List[str], seed: int,
+                              chunk_size: Optional[int] = None, max_bytes: Optional[int] = None,
+                              block_size: Optional[int] = None) -> Tuple[float, Dict[str, float]]:
+        """ Price and first order sensitivities to `names` with paths simulated block by block. See _stream """
+        return self._stream(params, tuple(names), seed, chunk_size, max_bytes, block_size)
+
+    @_scoped
+    def _stream(self, params: Dict[str, float], names: Tuple[str, ...], seed: int, chunk_size: Optional[int],
+                max_bytes: Optional[int], block_size: Optional[int]) -> Tuple[float, Dict[str, float]]:
+        """
+        Paths are split into seed blocks of STREAM_SEED_SIZE paths. Seed block i draws its innovations from the key
+        folded with i, is priced on its own and seed block results are averaged with an exactly rounded sum, so up to
+        single precision rounding the result only depends on the seed and num_paths. Memory settings choose how many
+        seed blocks are evaluated together: a block of block_size paths is vmapped over its seed blocks, and blocks of
+        a chunk run one after another inside one dispatch, so peak memory is that of a single block.
+        * block_size defaults to the largest power of two within max_bytes, or STREAM_BLOCK_SIZE without a budget. It
+          is rounded down to whole seed blocks
+        * The last seed block is shorter when num_paths is not a multiple of STREAM_SEED_SIZE and is weighted by paths
+        * chunk_size is the number of paths per dispatch and defaults to all paths
+        * Only linear payoff reductions (path averages) can be split this way
+        """
+        if not isinstance(self.innovations, PseudoRandom):
+            raise TypeError('Streaming draws innovations per block and only supports pseudo random numbers')
 
-        # Retrieve events and initialize model
+        model = self.initialized_model(params)
+        seed_size = min(STREAM_SEED_SIZE, self.num_paths)
+        if block_size is None:
+            block_size = STREAM_BLOCK_SIZE
+            if max_bytes is not None:
+                block_size = 2 ** int(math.log2(max(max_bytes // self.bytes_per_path(model, len(names)), 1)))
+        if max_bytes is not None and max(block_size, seed_size) * self.bytes_per_path(model, len(names)) > max_bytes:
+            raise ValueError(f'Block size {max(block_size, seed_size)} does not fit in {max_bytes} bytes')
+        num_seeds, remainder = divmod(self.num_paths, seed_size)
+        width = min(max(block_size // seed_size, 1), num_seeds)
+
+        # Runs of blocks with the same number of equally sized seed blocks: full blocks, the seed blocks left over and
+        # the short seed block, each run with its own executable
+        num_blocks = num_seeds // width
+        chunk_blocks = num_blocks if chunk_size is None else max(min(chunk_size // (width * seed_size), num_blocks), 1)
+        indices = numpy.arange(num_blocks * width).reshape(num_blocks, width)
+        runs = [(seed_size, indices[start: start + chunk_blocks]) for start in range(0, num_blocks, chunk_blocks)]
+        if num_seeds % width:
+            runs.append((seed_size, numpy.arange(num_blocks * width, num_seeds).reshape(1, -1)))
+        if remainder:
+            runs.append((remainder, numpy.array([[num_seeds]])))
+
+        key = jx.random.PRNGKey(seed)
+        sensitive_params = {name: params[name] for name in names}
+        fixed_params = {k: v for k, v in self.select(params).items() if k not in names}
+        values, grads = [], {name: [] for name in names}
+        for size, blocks in runs:
+            signature = (self._signature(model, size, self.precision.dtype), 'stream', names)
+            args = (sensitive_params, fixed_params, key, np.asarray(blocks))
+            executable = self._executable(signature, lambda on_trace: self._compile_chunk(model, names, size, on_trace),
+                                          args)
+            with phase('execute', method='stream', paths=blocks.size * size) as execution:
+                chunk_values, chunk_grads = execution.ready(executable(*args))
+            # Path sums, so that the short seed block gets its weight
+            values.extend((size * numpy.ravel(numpy.asarray(chunk_values, dtype=float))).tolist())
+            for name in names:
+                grads[name].extend((size * numpy.ravel(numpy.asarray(chunk_grads[name], dtype=float))).tolist())
+
+        return math.fsum(values) / self.num_paths, {name: math.fsum(grads[name]) / self.num_paths for name in names}
+
+    def _compile_chunk(self, model: Model, names: Tuple[str, ...], seed_size: int,
+                       on_trace: Callable[[], None]) -> Callable:
+        layout = model.layout
+        shape = model.innovation_shape(seed_size)
+        dtype = self.precision.dtype
+
+        def block_price(sensitives: Dict[str, float], fixed: Dict[str, float], innovations: np.ndarray) -> float:
+            return self.price_paths({**sensitives, **fixed}, innovations, layout)
+
+        evaluate = jx.value_and_grad(block_price) if names else lambda *args: (block_price(*args), {})
+
+        def chunk(sensitives: Dict[str, float], fixed: Dict[str, float], key: np.ndarray, blocks: np.ndarray):
+            on_trace()
+
+            def one_seed(index: np.ndarray):
+                innovations = jx.random.normal(jx.random.fold_in(key, index), shape, dtype=dtype)
+                return evaluate(sensitives, fixed, innovations)
+
+            # Seed blocks of a block are evaluated together and blocks run one after another
+            return jx.lax.map(jx.vmap(one_seed), blocks)
+
+        return jx.jit(chunk)
+
+    def bytes_per_path(self, model: Model, num_sensitivities: int) -> int:
+        """
+        Rough peak memory per path: innovations plus intermediates, more when differentiating. With checkpointing,
+        intermediates are held for segment boundaries and one segment
+        """
+        steps, factors, _ = model.innovation_shape(1)
+        held = steps
+        if self.segment_length:
+            held = min(steps, math.ceil(steps / self.segment_length) + self.segment_length)
+        return np.dtype(self.precision.dtype).itemsize * (steps * factors + held * STREAM_STATE_SIZE) * \
+            (1 + num_sensitivities)
+
+    def draw_innovations(self, model: Model, seed: int) -> np.ndarray:
+        """ Innovations of all paths for the schedule of an initialized model, in the path dtype """
+        with phase('generate', paths=self.num_paths) as generation:
+            innovations = model.generate_innovations(self.num_paths, seed, self.innovations, self.innovation_cache,
+                                                     self.precision.dtype)
+            return generation.ready(shard_paths(innovations) if self.shard else innovations)
+
+    def initialized_model(self, params: Dict[str, float]) -> Model:
+        """ Concrete pass to find the schedule and its layout. This only touches concrete values """
+        with phase('initialize'):
+            model, instrument = self._build(params)
+            model.initialize(instrument.build_forward_events(), monitoring=instrument.monitoring_schedule())
+            return model
+
+    def executable(self, model: Model, key: Tuple, build: Callable[[Callable[[], None]], Callable],
+                   args: Tuple) -> Callable:
+        """
+        Compiled function built by `build` for the schedule of `model`, cached in the compile cache of this pricer
+        together with `key`, which must hold everything else static to the trace. See _executable
+        """
+        return self._executable((self._signature(model, self.num_paths, self.precision.dtype),) + tuple(key), build,
+                                args)
+
+    def _executable(self, signature: Any, build: Callable[[Callable[[], None]], Callable], args: Tuple) -> Callable:
+        """
+        Function for `signature` compiled ahead of time for the structure, shapes and dtypes of `args`, so that the
+        execute phase only covers execution. With a store, it is exported on first use and loaded afterwards
+        """
+        def compiled(on_trace: Callable[[], None]) -> Callable:
+            with phase('prepare', stored=self.store is not None):
+                jitted = build(on_trace) if self.store is None else self.store.get(signature, build(on_trace), args)
+                return jitted.lower(*args).compile()
+        return self.cache.get(signature, compiled, argument_key(args))
+
+    def _signature(self, model: Model, num_paths: int, dtype: np.dtype) -> CompiledSignature:
+        return CompiledSignature(self.model_class, self.instr_class, tuple(numpy.asarray(model.schedule).tolist()),
+                                 model.layout, num_paths, str(np.dtype(dtype)), self.precision, self.segment_length,
+                                 tuple(sorted(self.settings.items())))
+
+    def _stack(self, values: List[Any]) -> np.ndarray:
+        """ Values of one parameter across scenarios in the path dtype, so that x64 does not promote the paths """
+        return np.stack([np.asarray(value, dtype=self.precision.dtype) for value in values])
+
+    def select(self, params: Dict[str, float]) -> Dict[str, float]:
+        """ Only pass the parameters used by the components to compiled functions to avoid spurious retraces """
+        all_params = {**self.model_class.defaults(), **self.instr_class.defaults(), **params}
+        return {k: all_params[k] for k in self.model_class.parameters() + self.instr_class.parameters()}
+
+    def price_paths(self, params: Dict[str, float], innovations: np.ndarray, layout: ScheduleLayout) -> float:
+        """ Price on given innovations for a schedule with `layout`. Parameters may be traced, including dates """
+        model, instrument = self._build(params)
         forward_events = instrument.build_forward_events()
         backward_events = instrument.build_backward_events()
-        model.initialize(forward_events)
+        model.initialize(forward_events, layout, instrument.monitoring_schedule())
+        grids = model.simulate(innovations, self.segment_length, instrument.path_statistics())
+        return run_events(forward_events, backward_events, grids)
 
-        # Generate paths
-        grids = model.populate_grids(self.num_paths, seed)
-        last = len(grids) - 1
+    def _compile(self, layout: ScheduleLayout, on_trace: Callable[[], None]) -> Callable:
 
-        # Forward pass
-        for idx, (time_point, act) in enumerate(forward_events):
-            this_slice = grids[idx]
-            assert this_slice['time'] == time_point
-            act(this_slice)
+        def price(params: Dict[str, float], innovations: np.ndarray) -> float:
+            on_trace()
+            return self.price_paths(params, innovations, layout)
 
-        # Backward pass
-        for idx, (time_point, act) in enumerate(backward_events[:-1]):
-            this_slice = grids[last - idx - 1]
-            assert this_slice['time'] == time_point
-            act(grids[last - idx], this_slice)
+        return jx.jit(price)
 
-        _, payoff = backward_events[-1]
-        price = payoff(grids[0], {'numeraire': np.array(1.0)})
-        assert price is not None
-        return price
+    def cache_info(self) -> Dict[str, int]:
+        return self.cache.stats()
 
     def generate_d1_fn(self, params: Dict[str, float], names: List[str], vector_name: str, seed: int) -> Callable:
 
@@ -56,7 +487,11 @@ class Pricer:
             return self.unit_price({**sensitives, **vector_var, **fixed_params}, seed)
 
         sensitive_params = {name: params[name] for name in names}
-        return lambda x: jx.vmap(jx.value_and_grad(wrapper), in_axes=(None, 0))(sensitive_params, {vector_name: x})
+
+        def d1_fn(x: np.ndarray):
+            with self.precision.scope(), instrumented(self.instrumentation):
+                return jx.vmap(jx.value_and_grad(wrapper), in_axes=(None, 0))(sensitive_params, {vector_name: x})
+        return d1_fn
 
     def generate_d2_fn(self, params: Dict[str, float], name1: str, name2: str, vector_name: str, seed: int) -> Callable:
 
@@ -75,36 +510,121 @@ class Pricer:
             dict2 = {name2: params[name2]}
 
         v_fn = jx.vmap(jx.grad(lambda *args: jx.grad(wrapper)(*args)[name1], argnums=(idx,)), in_axes=(None, None, 0))
-        return lambda x: v_fn(dict1, dict2, {vector_name: x})[0][name2]
+
+        def d2_fn(x: np.ndarray):
+            with self.precision.scope(), instrumented(self.instrumentation):
+                return v_fn(dict1, dict2, {vector_name: x})[0][name2]
+        return d2_fn
+
+    @_scoped
+    def risk(self, params: Dict[str, float], names: List[str], pairs: List[Tuple[str, str]], vector_name: str,
+             vector: np.ndarray, seed: int) -> 'RiskResult':
+        """
+        Price, first order greeks to `names` and second order greeks for `pairs` over `vector` in one compiled call.
+        Second order greeks are forward-over-reverse: one reverse sweep gives the gradient and we push one tangent
+        per element of each distinct first name of `pairs` through it. Paths and payoffs are shared by all outputs.
+        For array valued parameters, e.g. the spots of a multi-asset model, the greek of a pair has the shape of the
+        first parameter followed by the shape of the second after the vector axis
+        """
+        names = tuple(dict.fromkeys(list(names) + [name for pair in pairs for name in pair]))
+        pairs = tuple(pairs)
+        model = self.initialized_model(params)
+        innovations = self.draw_innovations(model, seed)
+        signature = (self._signature(model, self.num_paths, innovations.dtype), 'risk', names, pairs, vector_name)
+        sensitive_params = {name: params[name] for name in names}
+        fixed_params = {k: v for k, v in self.select(params).items() if k not in names and k != vector_name}
+        args = (sensitive_params, fixed_params, vector, innovations)
+        executable = self._executable(signature, lambda on_trace: self._compile_risk(model.layout, names, pairs,
+                                                                                     vector_name, on_trace), args)
+        with phase('execute', method='risk', paths=self.num_paths, vector=len(vector)) as execution:
+            price, first_order, second_order = execution.ready(executable(*args))
+        return RiskResult(price, first_order, {pair: second_order[idx] for idx, pair in enumerate(pairs)})
+
+    def _compile_risk(self, layout: ScheduleLayout, names: Tuple[str, ...], pairs: Tuple[Tuple[str, str], ...],
+                      vector_name: str, on_trace: Callable[[], None]) -> Callable:
+        rows = tuple(dict.fromkeys(pair[0] for pair in pairs))
+
+        def greeks(sensitives: Dict[str, float], fixed: Dict[str, float], vector_value: float, innovations: np.ndarray):
+            def price(x: Dict[str, float]) -> float:
+                return self.price_paths({**x, **fixed, vector_name: vector_value}, innovations, layout)
+
+            if not rows:
+                value, grad = jx.value_and_grad(price)(sensitives)
+                return value, grad, ()
+
+            # One tangent per element of each row name, stacked along a leading axis
+            shapes = {name: np.shape(value) for name, value in sensitives.items()}
+            offsets = dict(zip(rows, numpy.cumsum([0] + [math.prod(shapes[row]) for row in rows])))
+            num_tangents = sum(math.prod(shapes[row]) for row in rows)
+            tangents = {name: np.zeros((num_tangents,) + shapes[name], dtype=np.result_type(value))
+                        for name, value in sensitives.items()}
+            for row in rows:
+                size = math.prod(shapes[row])
+                block = np.eye(size, dtype=tangents[row].dtype).reshape((size,) + shapes[row])
+                tangents[row] = tangents[row].at[offsets[row]: offsets[row] + size].set(block)
+
+            # Primal and reverse sweep are not batched by vmap so they are computed once for all tangents
+            def push(tangent: Dict[str, float]):
+                return jx.jvp(jx.value_and_grad(price), (sensitives,), (tangent,))
+
+            (value, grad), (_, hessian) = jx.vmap(push, out_axes=((None, None), 0))(tangents)
+            return value, grad, tuple(
+                hessian[name2][offsets[name1]: offsets[name1] + math.prod(shapes[name1])].reshape(
+                    shapes[name1] + shapes[name2]) for name1, name2 in pairs)
+
+        def risk(sensitives: Dict[str, float], fixed: Dict[str, float], vector: np.ndarray, innovations: np.ndarray):
+            on_trace()
+            return jx.vmap(greeks, in_axes=(None, None, 0, None))(sensitives, fixed, vector, innovations)
+
+        return jx.jit(risk)
 
     def profile_risk(self, params: Dict[str, float], seed: int) -> None:
         start = time.time()
         strikes = np.linspace(50, 150, 200)
-
-        # 1st order greeks
-        d_fn = self.generate_d1_fn(params, ['spot', 'volatility', 'expiration'], 'strike', seed)
-        price, greek1 = d_fn(strikes)
-
-        # 2nd order greeks
-        gamma = self.generate_d2_fn(params, 'spot', 'spot', 'strike', seed)(strikes)
-        volga = self.generate_d2_fn(params, 'volatility', 'volatility', 'strike', seed)(strikes)
-        vanna = self.generate_d2_fn(params, 'spot', 'volatility', 'strike', seed)(strikes)
-        vanna.block_until_ready()
+        result = self.risk(params, ['spot', 'volatility', 'expiration'],
+                           [('spot', 'spot'), ('volatility', 'volatility'), ('spot', 'volatility')], 'strike', strikes,
+                           seed)
+        result.price.block_until_ready()
 
         print(f'Evaluation takes {time.time() - start:.2f}s')
 
         plots = [
-            ('price', price),
-            ('delta', greek1['spot']),
-            ('gamma', gamma),
-            ('vega', greek1['volatility']),
-            ('volga', volga),
-            ('vanna', vanna),
+            ('price', result.price),
+            ('delta', result.first_order['spot']),
+            ('gamma', result.second_order[('spot', 'spot')]),
+            ('vega', result.first_order['volatility']),
+            ('volga', result.second_order[('volatility', 'volatility')]),
+            ('vanna', result.second_order[('spot', 'volatility')]),
         ]
         plot_lines(self.instr_class.__name__, 'log-moneyness', np.log(params['spot'] / strikes), plots, num_cols=2)
 
 
+def run_events(forward_events: Tuple[Tuple[float, ForwardActionT], ...],
+               backward_events: Tuple[Tuple[float, BackwardActionT], ...], grids: List[Dict[str, np.ndarray]]) -> float:
+    """ Run the instrument's forward and backward passes. grids[i] is the slice of the i-th forward event """
+    last = len(grids) - 1
+
+    # Forward pass
+    with jx.named_scope('forward'):
+        for idx, (_, act) in enumerate(forward_events):
+            act(grids[idx])
+
+    # Backward pass
+    with jx.named_scope('backward'):
+        for idx, (_, act) in enumerate(backward_events[:-1]):
+            act(grids[last - idx], grids[last - idx - 1])
+
+        _, payoff = backward_events[-1]
+        price = payoff(grids[0], {'numeraire': np.array(1.0)})
+    assert price is not None
+    return price
+
+
 def plot_lines(title: str, axis_title: str, axis: np.ndarray, plots: List[Tuple[str, np.ndarray]], num_cols: int = 1):
+    # Imported here so that headless workers do not pay for plotly at startup
+    from plotly.subplots import make_subplots
+    import plotly.graph_objects as go
+
     num_rows = int(np.ceil(len(plots) / num_cols))
     titles = [plot[0] for plot in plots]
     fig = make_subplots(num_rows, num_cols, subplot_titles=titles)
@@ -1,3 +1,7 @@
 from flexpricer.instrument.base_instrument import Instrument
 from flexpricer.instrument.vanilla import Vanilla
-from flexpricer.instrument.digital import Digital
\ No newline at end of file
+from flexpricer.instrument.digital import Digital
+from flexpricer.instrument.bermudan import Bermudan, BermudanPut, BermudanCall
+from flexpricer.instrument.path_dependent import PathDependent, Asian, LookbackCall, LookbackPut, Barrier, \
+    DownAndOutCall, UpAndOutCall
+from flexpricer.instrument.basket import MultiAsset, Basket, WorstOf, BestOf
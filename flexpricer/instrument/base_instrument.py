@@ -1,9 +1,10 @@
-from typing import Tuple, Callable, Dict, Optional
+from typing import Tuple, Callable, Dict, Optional, Union
 from dataclasses import dataclass
 import abc
 import jax.numpy as np
 
 from flexpricer.base_component import PricerComponent
+from flexpricer.model.base_model import PathStatistics
 
 
 # Dict is t's slice.
@@ -12,6 +13,11 @@ ForwardActionT = Callable[[Dict[str, np.ndarray]], Optional[float]]
 BackwardActionT = Callable[[Dict[str, np.ndarray], Dict[str, np.ndarray]], Optional[float]]
 
 
+def smooth_call(diff: np.ndarray, smooth: float) -> np.ndarray:
+    """ max(diff, 0) smoothed with tanh over a width of about smooth, so that pathwise greeks exist """
+    return diff * (np.tanh(6 / smooth * diff) + 1) / 2
+
+
 @dataclass
 class Instrument(PricerComponent, abc.ABC):
 
@@ -22,3 +28,11 @@ class Instrument(PricerComponent, abc.ABC):
     @abc.abstractmethod
     def build_backward_events(self) -> Tuple[Tuple[float, BackwardActionT], ...]:
         """ Set up events for backward pass """
+
+    def monitoring_schedule(self) -> Union[Tuple[float, ...], np.ndarray]:
+        """ Dates the simulation must step to without an event, e.g. to monitor a barrier """
+        return ()
+
+    def path_statistics(self) -> Optional[PathStatistics]:
+        """ Running statistics the model carries through every simulation step, see Model.observe """
+        return None
@@ -0,0 +1,69 @@
+"""
+Options on several assets, for models whose spot has shape (num_assets, num_paths)
+"""
+from typing import Tuple
+from dataclasses import dataclass, field
+import abc
+import jax.numpy as np
+
+from flexpricer.instrument.base_instrument import Instrument, ForwardActionT, BackwardActionT, smooth_call
+from flexpricer.precision import path_mean
+
+
+@dataclass
+class MultiAsset(Instrument, abc.ABC):
+    """ Call on one number per path computed from all spots at expiration, smoothed like Vanilla """
+
+    # Instrument parameters
+    smooth: float
+    strike: float
+    expiration: float
+
+    # Private variables
+    _price: float = field(init=False, repr=False)
+
+    @abc.abstractmethod
+    def underlying(self, spot: np.ndarray) -> np.ndarray:
+        """ Value the strike applies to, from spot of shape (num_assets, num_paths) """
+
+    def payoff(self, spot: np.ndarray) -> None:
+        self._price = path_mean(smooth_call(self.underlying(spot) - self.strike, self.smooth))
+
+    def build_forward_events(self) -> Tuple[Tuple[float, ForwardActionT], ...]:
+        return ((self.expiration, lambda variables: self.payoff(variables['spot'])),)
+
+    def build_backward_events(self) -> Tuple[Tuple[float, BackwardActionT], ...]:
+        return ((0, lambda prev, curr: self._price / prev['numeraire'] * curr['numeraire']),)
+
+
+@dataclass
+class Basket(MultiAsset):
+    """ Call on the weighted sum of spots """
+
+    # Instrument parameters
+    weights: np.ndarray
+
+    def underlying(self, spot: np.ndarray) -> np.ndarray:
+        return np.asarray(self.weights, dtype=spot.dtype) @ spot
+
+
+@dataclass
+class WorstOf(MultiAsset):
+    """ Call on the worst performance spot / reference, with the strike as a performance level """
+
+    # Instrument parameters
+    reference: np.ndarray  # One level per asset, usually initial spots
+
+    def underlying(self, spot: np.ndarray) -> np.ndarray:
+        return np.min(spot / np.reshape(np.asarray(self.reference, dtype=spot.dtype), (-1, 1)), axis=0)
+
+
+@dataclass
+class BestOf(MultiAsset):
+    """ Call on the best performance spot / reference, with the strike as a performance level """
+
+    # Instrument parameters
+    reference: np.ndarray  # One level per asset, usually initial spots
+
+    def underlying(self, spot: np.ndarray) -> np.ndarray:
+        return np.max(spot / np.reshape(np.asarray(self.reference, dtype=spot.dtype), (-1, 1)), axis=0)
@@ -0,0 +1,97 @@
+"""
+Bermudan options priced with Longstaff-Schwartz regression in the backward pass
+"""
+from typing import Tuple, Dict, Optional
+from dataclasses import dataclass, field
+import abc
+import jax.numpy as np
+import jax as jx
+
+from flexpricer.instrument.base_instrument import Instrument, ForwardActionT, BackwardActionT, smooth_call
+from flexpricer.precision import path_mean
+
+# Ridge added to the normal equations so that dates with few in-the-money paths stay solvable
+RIDGE = 1e-6
+
+
+@dataclass
+class Bermudan(Instrument, abc.ABC):
+    """
+    Exercisable at num_exercises equally spaced dates up to expiration. Going backwards, the deflated cash flow of
+    each path is regressed on polynomials of moneyness over in-the-money paths, and a path exercises when the exercise
+    value beats the fitted continuation value. Exercise decisions carry no gradient, cash flows do. Exercise values are
+    smoothed as in Vanilla so that gamma exists; they go slightly negative out of the money, which never exercises.
+    With coefficients from a pre-run on independent paths (see Pricer.fit_exercise) the estimate has no foresight bias
+    """
+
+    # Instrument parameters
+    smooth: float
+    strike: float
+    expiration: float
+    coefficients: Optional[np.ndarray] = None  # Shape (num_exercises - 1, degree + 1). None regresses on priced paths
+
+    # Settings, see PricerComponent
+    num_exercises: int = field(default=4, metadata={'static': True})
+    degree: int = field(default=3, metadata={'static': True})
+
+    # Private variables
+    _fitted: Dict[int, np.ndarray] = field(init=False, repr=False, default_factory=dict)
+
+    @abc.abstractmethod
+    def exercise_value(self, spot: np.ndarray) -> np.ndarray:
+        """ Undiscounted value of exercising now """
+
+    @property
+    def fitted_coefficients(self) -> np.ndarray:
+        """ Coefficients used in the last backward pass, in exercise date order """
+        return np.stack([self._fitted[idx] for idx in range(self.num_exercises - 1)])
+
+    def exercise_dates(self) -> Tuple[float, ...]:
+        return tuple(self.expiration * idx / self.num_exercises for idx in range(1, self.num_exercises + 1))
+
+    def basis(self, spot: np.ndarray) -> np.ndarray:
+        moneyness = spot / self.strike
+        return np.stack([moneyness ** power for power in range(self.degree + 1)])
+
+    def record(self, variables: Dict[str, np.ndarray]) -> None:
+        """ Deflated cash flow if exercised at this date. The backward pass replaces it with the optimal one """
+        variables['cashflow'] = self.exercise_value(variables['spot']) / variables['numeraire']
+
+    def exercise(self, idx: int, prev: Dict[str, np.ndarray], curr: Dict[str, np.ndarray]) -> None:
+        immediate = curr['cashflow']
+        basis = self.basis(curr['spot'])
+        if self.coefficients is None:
+            # Weighted normal equations over in-the-money paths, one (degree + 1) system per date
+            weighted = jx.lax.stop_gradient(basis * (immediate > 0))
+            gram = weighted @ jx.lax.stop_gradient(basis).T / immediate.shape[-1]
+            target = weighted @ jx.lax.stop_gradient(prev['cashflow']) / immediate.shape[-1]
+            beta = np.linalg.solve(gram + RIDGE * np.eye(self.degree + 1, dtype=gram.dtype), target)
+        else:
+            beta = np.asarray(self.coefficients)[idx]
+        self._fitted[idx] = beta
+
+        continuation = jx.lax.stop_gradient(beta @ basis)
+        curr['cashflow'] = np.where((immediate > 0) & (immediate >= continuation), immediate, prev['cashflow'])
+
+    def build_forward_events(self) -> Tuple[Tuple[float, ForwardActionT], ...]:
+        return tuple((date, self.record) for date in self.exercise_dates())
+
+    def build_backward_events(self) -> Tuple[Tuple[float, BackwardActionT], ...]:
+        dates = self.exercise_dates()
+        rollback = tuple((dates[idx], lambda prev, curr, idx=idx: self.exercise(idx, prev, curr))
+                         for idx in reversed(range(self.num_exercises - 1)))
+        return rollback + ((0, lambda prev, curr: path_mean(prev['cashflow']) * curr['numeraire']),)
+
+
+@dataclass
+class BermudanPut(Bermudan):
+
+    def exercise_value(self, spot: np.ndarray) -> np.ndarray:
+        return smooth_call(self.strike - spot, self.smooth)
+
+
+@dataclass
+class BermudanCall(Bermudan):
+
+    def exercise_value(self, spot: np.ndarray) -> np.ndarray:
+        return smooth_call(spot - self.strike, self.smooth)
@@ -6,6 +6,7 @@ from dataclasses import dataclass, field
 import jax.numpy as np
 
 from flexpricer.instrument.base_instrument import Instrument, ForwardActionT, BackwardActionT
+from flexpricer.precision import path_mean
 
 
 @dataclass
@@ -21,7 +22,7 @@ class Digital(Instrument):
 
     def payoff(self, spot: np.ndarray) -> None:
         constant = 6 / self.smooth
-        self._price = np.mean((np.tanh(constant * (spot - self.strike)) + 1)) / 2
+        self._price = path_mean(np.tanh(constant * (spot - self.strike)) + 1) / 2
 
     def build_forward_events(self) -> Tuple[Tuple[float, ForwardActionT], ...]:
         return ((self.expiration, lambda variables: self.payoff(variables['spot'])),)
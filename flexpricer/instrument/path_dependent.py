@@ -0,0 +1,141 @@
+"""
+Path dependent options. Their payoffs depend on running statistics that the model updates after every simulation
+step, so memory stays proportional to the number of paths whatever the monitoring frequency
+"""
+from typing import Tuple, Dict, ClassVar
+from dataclasses import dataclass, field
+import abc
+import jax.numpy as np
+
+from flexpricer.instrument.base_instrument import Instrument, ForwardActionT, BackwardActionT, smooth_call
+from flexpricer.model.base_model import PathStatistics, StateT
+from flexpricer.precision import path_mean
+
+
+@dataclass
+class PathDependent(Instrument, abc.ABC):
+    """
+    Single payment at expiration. The simulation steps to num_monitoring equally spaced dates and to any date the model
+    requires, and statistics are updated at all of them, so continuous monitoring is approximated by the full grid
+    """
+
+    # Instrument parameters
+    smooth: float
+    strike: float
+    expiration: float
+
+    num_monitoring: ClassVar[int] = 64
+
+    # Private variables
+    _price: float = field(init=False, repr=False)
+
+    @abc.abstractmethod
+    def initial_statistics(self, state: StateT) -> StateT:
+        """ Statistics at t=0 """
+
+    @abc.abstractmethod
+    def update(self, statistics: StateT, prev: StateT, curr: StateT, dt: np.ndarray) -> StateT:
+        """ Statistics after the step from prev to curr """
+
+    @abc.abstractmethod
+    def payoff(self, variables: Dict[str, np.ndarray]) -> np.ndarray:
+        """ Path-wise payoff from the state and statistics at expiration """
+
+    def monitoring_schedule(self) -> np.ndarray:
+        # Expiration is the event date. Repeating it here in another precision could add a zero length step
+        return self.expiration * np.arange(1, self.num_monitoring) / self.num_monitoring
+
+    def path_statistics(self) -> PathStatistics:
+        return self.initial_statistics, self.update
+
+    def record(self, variables: Dict[str, np.ndarray]) -> None:
+        self._price = path_mean(self.payoff(variables))
+
+    def build_forward_events(self) -> Tuple[Tuple[float, ForwardActionT], ...]:
+        return ((self.expiration, self.record),)
+
+    def build_backward_events(self) -> Tuple[Tuple[float, BackwardActionT], ...]:
+        return ((0, lambda prev, curr: self._price / prev['numeraire'] * curr['numeraire']),)
+
+
+@dataclass
+class Asian(PathDependent):
+    """ Call on the time average of spot over [0, expiration], integrated with the trapezoidal rule """
+
+    def initial_statistics(self, state: StateT) -> StateT:
+        return {'integral': np.zeros_like(state['spot'])}
+
+    def update(self, statistics: StateT, prev: StateT, curr: StateT, dt: np.ndarray) -> StateT:
+        return {'integral': statistics['integral'] + (prev['spot'] + curr['spot']) / 2 * dt}
+
+    def payoff(self, variables: Dict[str, np.ndarray]) -> np.ndarray:
+        return smooth_call(variables['integral'] / self.expiration - self.strike, self.smooth)
+
+
+@dataclass
+class LookbackCall(PathDependent):
+    """ Call on the maximum of spot, including the spot at t=0 """
+
+    def initial_statistics(self, state: StateT) -> StateT:
+        return {'running_max': state['spot']}
+
+    def update(self, statistics: StateT, prev: StateT, curr: StateT, dt: np.ndarray) -> StateT:
+        return {'running_max': np.maximum(statistics['running_max'], curr['spot'])}
+
+    def payoff(self, variables: Dict[str, np.ndarray]) -> np.ndarray:
+        return smooth_call(variables['running_max'] - self.strike, self.smooth)
+
+
+@dataclass
+class LookbackPut(PathDependent):
+    """ Put on the minimum of spot, including the spot at t=0 """
+
+    def initial_statistics(self, state: StateT) -> StateT:
+        return {'running_min': state['spot']}
+
+    def update(self, statistics: StateT, prev: StateT, curr: StateT, dt: np.ndarray) -> StateT:
+        return {'running_min': np.minimum(statistics['running_min'], curr['spot'])}
+
+    def payoff(self, variables: Dict[str, np.ndarray]) -> np.ndarray:
+        return smooth_call(self.strike - variables['running_min'], self.smooth)
+
+
+@dataclass
+class Barrier(PathDependent, abc.ABC):
+    """
+    Knock-out call. Survival is the product over monitoring steps of a tanh step in the distance to the barrier with
+    the same width as the payoff, so the price has pathwise greeks, including to the barrier
+    """
+
+    # Instrument parameters
+    barrier: float
+
+    @abc.abstractmethod
+    def distance(self, spot: np.ndarray) -> np.ndarray:
+        """ Positive on the side of the barrier where the option is alive """
+
+    def alive(self, spot: np.ndarray) -> np.ndarray:
+        return (np.tanh(6 / self.smooth * self.distance(spot)) + 1) / 2
+
+    def initial_statistics(self, state: StateT) -> StateT:
+        return {'survival': self.alive(state['spot'])}
+
+    def update(self, statistics: StateT, prev: StateT, curr: StateT, dt: np.ndarray) -> StateT:
+        return {'survival': statistics['survival'] * self.alive(curr['spot'])}
+
+    def payoff(self, variables: Dict[str, np.ndarray]) -> np.ndarray:
+        return variables['survival'] * smooth_call(variables['spot'] - self.strike, self.smooth)
+
+
+@dataclass
+class DownAndOutCall(Barrier):
+
+    def distance(self, spot: np.ndarray) -> np.ndarray:
+        return spot - self.barrier
+
+
+@dataclass
+class UpAndOutCall(Barrier):
+
+    def distance(self, spot: np.ndarray) -> np.ndarray:
+        return self.barrier - spot
@@ -5,7 +5,8 @@ from typing import Tuple
 from dataclasses import dataclass, field
 import jax.numpy as np
 
-from flexpricer.instrument.base_instrument import Instrument, ForwardActionT, BackwardActionT
+from flexpricer.instrument.base_instrument import Instrument, ForwardActionT, BackwardActionT, smooth_call
+from flexpricer.precision import path_mean
 
 
 @dataclass
@@ -20,9 +21,7 @@ class Vanilla(Instrument):
     _price: float = field(init=False, repr=False)
 
     def payoff(self, spot: np.ndarray) -> None:
-        diff = spot - self.strike
-        constant = 6 / self.smooth
-        self._price = np.mean(diff * (np.tanh(constant * diff) + 1)) / 2
+        self._price = path_mean(smooth_call(spot - self.strike, self.smooth))
 
     def build_forward_events(self) -> Tuple[Tuple[float, ForwardActionT], ...]:
         return ((self.expiration, lambda variables: self.payoff(variables['spot'])),)
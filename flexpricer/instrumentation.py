@@ -0,0 +1,155 @@
+"""
+Phase level timing of pricing runs. Pricer reports initialize, generate, prepare and execute phases, and JAX reports
+trace, lower and compile phases of every compilation, to the instrumentation of the running pricer. Executables are
+compiled in prepare, so execute never contains compilation. The default instrumentation is disabled and phases then
+reduce to a shared null context
+"""
+from typing import Dict, Any, List, Optional, Iterator
+from dataclasses import dataclass, field
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+import time
+import resource
+import jax as jx
+import jax.monitoring
+
+# JAX compilation events and the phase they are reported as. They nest inside the phase that triggered compilation
+COMPILE_EVENTS = {
+    '/jax/core/compile/jaxpr_trace_duration': 'trace',
+    '/jax/core/compile/jaxpr_to_mlir_module_duration': 'lower',
+    '/jax/core/compile/backend_compile_duration': 'compile',
+}
+
+
+@dataclass
+class PhaseEvent:
+    phase: str
+    seconds: float
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    device_bytes: Optional[int] = None  # In use on the default device at the end of the phase, if the backend reports it
+    peak_rss_bytes: Optional[int] = None  # Peak resident memory of the process at the end of the phase
+
+
+class Instrumentation:
+    """ Receives phase events. This default is disabled and ignores everything. Subclass record to forward events """
+    enabled: bool = False
+    # Wrap phases in jax.profiler annotations so that they show up in a trace captured with capture_trace
+    annotate: bool = False
+
+    def record(self, event: PhaseEvent) -> None:
+        pass
+
+
+class Recorder(Instrumentation):
+    """ Keeps every event in memory """
+    enabled = True
+
+    def __init__(self, annotate: bool = False) -> None:
+        self.annotate = annotate
+        self.events: List[PhaseEvent] = []
+
+    def record(self, event: PhaseEvent) -> None:
+        self.events.append(event)
+
+    def totals(self) -> Dict[str, float]:
+        """ Seconds per phase, summed over events """
+        totals = defaultdict(float)
+        for event in self.events:
+            totals[event.phase] += event.seconds
+        return dict(totals)
+
+    def clear(self) -> None:
+        self.events.clear()
+
+
+DISABLED = Instrumentation()
+_ACTIVE: ContextVar = ContextVar('instrumentation', default=DISABLED)
+
+
+class _NullPhase:
+
+    def __enter__(self) -> '_NullPhase':
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    @staticmethod
+    def ready(value: Any) -> Any:
+        return value
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(_NullPhase):
+
+    def __init__(self, instrumentation: Instrumentation, name: str, attributes: Dict[str, Any]) -> None:
+        self.instrumentation = instrumentation
+        self.name = name
+        self.attributes = attributes
+        self.annotation = jx.profiler.TraceAnnotation(name) if instrumentation.annotate else None
+
+    def __enter__(self) -> '_Phase':
+        if self.annotation is not None:
+            self.annotation.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        seconds = time.perf_counter() - self.start
+        if self.annotation is not None:
+            self.annotation.__exit__(*args)
+        self.instrumentation.record(PhaseEvent(self.name, seconds, self.attributes, _device_bytes(), _peak_rss()))
+
+    @staticmethod
+    def ready(value: Any) -> Any:
+        """ Wait for asynchronously dispatched results so that the phase covers their computation """
+        if any(isinstance(leaf, jx.core.Tracer) for leaf in jx.tree_util.tree_leaves(value)):
+            return value
+        return jx.block_until_ready(value)
+
+
+def phase(name: str, **attributes: Any) -> _NullPhase:
+    """ Time a block as one phase of the active instrumentation. Use ready() on results computed inside the block """
+    instrumentation = _ACTIVE.get()
+    if not instrumentation.enabled:
+        return _NULL_PHASE
+    return _Phase(instrumentation, name, attributes)
+
+
+@contextmanager
+def scope(instrumentation: Instrumentation) -> Iterator[None]:
+    """ Send phases of the enclosed block, including JAX compilation events, to `instrumentation` """
+    token = _ACTIVE.set(instrumentation)
+    try:
+        yield
+    finally:
+        _ACTIVE.reset(token)
+
+
+@contextmanager
+def capture_trace(directory: str) -> Iterator[None]:
+    """ Capture a JAX profiler trace of the enclosed block into `directory`, e.g. for TensorBoard or Perfetto """
+    with jx.profiler.trace(directory):
+        yield
+
+
+def _on_duration(event: str, seconds: float, **kwargs: Any) -> None:
+    instrumentation = _ACTIVE.get()
+    if instrumentation.enabled and event in COMPILE_EVENTS:
+        instrumentation.record(PhaseEvent(COMPILE_EVENTS[event], seconds, dict(kwargs), _device_bytes(), _peak_rss()))
+
+
+def _device_bytes() -> Optional[int]:
+    stats = jx.local_devices()[0].memory_stats()
+    return None if stats is None else stats.get('bytes_in_use')
+
+
+def _peak_rss() -> int:
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+jax.monitoring.register_event_duration_secs_listener(_on_duration)
@@ -1,3 +1,6 @@
 from flexpricer.model.base_model import Model
+from flexpricer.model.innovations import InnovationSource, PseudoRandom, SobolBridge, Antithetic, InnovationCache
 from flexpricer.model.black_scholes import BlackScholes
 from flexpricer.model.arithmetic_black_scholes import ArithmeticBlackScholes
+from flexpricer.model.heston import Heston
+from flexpricer.model.multi_asset_black_scholes import MultiAssetBlackScholes
@@ -3,11 +3,11 @@ Arithmetic Black Scholes model.
 * Use Geometric Black Scholes parameters as input and convert them internally
 * Does not support rate and dividend
 """
-from typing import List, Tuple, Dict
+from typing import Tuple
 from dataclasses import dataclass
 from jax import numpy as np
 
-from flexpricer.model.base_model import Model
+from flexpricer.model.base_model import Model, StateT
 
 
 @dataclass
@@ -19,13 +19,10 @@ class ArithmeticBlackScholes(Model):
     def _get_required_schedule(self, expiration) -> Tuple[float]:
         return (expiration,)
 
-    def _generate_slices(self, dts: Tuple[float], innovations: np.ndarray) -> List[Dict[str, np.ndarray]]:
-        grid = []
-        spot = np.array(self.spot)
-        numeraire = np.array(1.0)
-        arithmetic_vol = self.volatility * self.spot
-        for dt, innovation in zip(dts, innovations):
-            spot = spot + arithmetic_vol * np.sqrt(dt) * innovation
-            grid.append({'spot': spot, 'numeraire': numeraire})
+    def _initial_state(self, num_paths: int, dtype: np.dtype) -> StateT:
+        return {'spot': self.spot * np.ones(num_paths, dtype=dtype), 'numeraire': np.ones((), dtype=dtype)}
 
-        return grid
+    def _step(self, state: StateT, dt: float, innovation: np.ndarray) -> StateT:
+        arithmetic_vol = self.volatility * self.spot
+        spot = state['spot'] + arithmetic_vol * np.sqrt(dt) * innovation[0]
+        return {'spot': spot, 'numeraire': state['numeraire']}
@@ -1,51 +1,183 @@
-from typing import Tuple, Dict, Callable, List
+from typing import Tuple, Dict, Callable, List, Optional, Sequence, Union, Any
 from dataclasses import dataclass, field
 import abc
 
+import numpy
 import jax.numpy as np
 import jax as jx
+from jax import lax
 
 from flexpricer.base_component import PricerComponent
+from flexpricer.model.innovations import InnovationSource, PseudoRandom, InnovationCache
+
+
+# First tuple maps each (unique, sorted) grid point to the time point that defines it. Second tuple maps each
+# instrument event to its grid index. It only depends on the ordering of time points so it can be computed once from
+# concrete values and reused when the time points are traced.
+ScheduleLayout = Tuple[Tuple[int, ...], Tuple[int, ...]]
+# State of all model variables at one grid point, e.g. spot, numeraire
+StateT = Dict[str, np.ndarray]
+# Running statistics of each path, e.g. a running maximum. The first function gives their values from the state at t=0,
+# the second updates them after each step from the statistics, the states before and after the step and its length
+PathStatistics = Tuple[Callable[[StateT], StateT], Callable[[StateT, StateT, StateT, np.ndarray], StateT]]
 
 
 @dataclass
 class Model(PricerComponent, abc.ABC):
 
-    _schedule: Tuple[float] = field(init=False, repr=False)
+    _schedule: np.ndarray = field(init=False, repr=False)
     _instrument_indices: Tuple[int] = field(init=False, repr=False)
+    _layout: ScheduleLayout = field(init=False, repr=False)
 
     @property
-    def schedule(self) -> Tuple[float]:
+    def schedule(self) -> np.ndarray:
         return self._schedule
 
-    def initialize(self, events: Tuple[Tuple[float, Callable], ...]) -> None:
+    @property
+    def layout(self) -> ScheduleLayout:
+        return self._layout
+
+    @property
+    def num_factors(self) -> int:
+        """ Number of independent innovations consumed per path per step """
+        return 1
+
+    def initialize(self, events: Tuple[Tuple[float, Callable], ...], layout: Optional[ScheduleLayout] = None,
+                   monitoring: Union[Tuple[float, ...], np.ndarray] = ()) -> None:
+        """ monitoring dates are added to the simulation grid without being observed, see Instrument """
         instrument_schedule = tuple(event[0] for event in events)
-        expiration = events[-1][0]
-        self._schedule = tuple(sorted(instrument_schedule + self._get_required_schedule(expiration)))
+        self.initialize_schedule(instrument_schedule, events[-1][0], layout, monitoring)
+
+    def initialize_schedule(self, instrument_schedule: Union[Tuple[float, ...], np.ndarray], expiration: float,
+                            layout: Optional[ScheduleLayout] = None,
+                            monitoring: Union[Tuple[float, ...], np.ndarray] = ()) -> None:
+        """ Same as initialize but takes event dates directly, in any order, together with the last one """
+        required_schedule = self._get_required_schedule(expiration)
+        if len(monitoring):
+            required_schedule = np.concatenate([np.ravel(np.asarray(required_schedule)),
+                                                np.ravel(np.asarray(monitoring))])
+        if layout is None:
+            layout = build_layout(instrument_schedule, required_schedule)
+
+        # Keep time points as one vector so that a fine schedule does not blow up the trace
+        time_points = np.concatenate([np.ravel(np.asarray(instrument_schedule)),
+                                      np.ravel(np.asarray(required_schedule))])
+        grid_sources, self._instrument_indices = layout
+        self._schedule = time_points[numpy.asarray(grid_sources)]
+        self._layout = layout
+
+    def time_steps(self) -> np.ndarray:
+        return np.concatenate([self.schedule[:1], np.diff(self.schedule)])
+
+    def innovation_shape(self, num_paths: int) -> Tuple[int, int, int]:
+        return len(self.schedule), self.num_factors, num_paths
+
+    def generate_innovations(self, num_paths: int, seed: int, source: Optional[InnovationSource] = None,
+                             cache: Optional[InnovationCache] = None, dtype: np.dtype = np.float32) -> np.ndarray:
+        """ Innovations of shape innovation_shape(num_paths). With a cache, repeated requests reuse the same array """
+        source = PseudoRandom() if source is None else source
+        dts = self.time_steps()
+
+        def generate() -> np.ndarray:
+            return source.generate(seed, dts, self.num_factors, num_paths, dtype)
 
-        # Figure out instrument schedule indices
-        self._instrument_indices = tuple(self.schedule.index(time_point) for time_point in instrument_schedule)
+        if cache is None:
+            return generate()
+        return cache.get(source, seed, dts, self.num_factors, num_paths, dtype, generate)
 
-    def populate_grids(self, num_paths: int, seed: int) -> List[Dict[str, np.ndarray]]:
-        # Prepare dt
-        dts = (self.schedule[0],) + tuple(curr - prev for curr, prev in zip(self.schedule[1:], self.schedule[:-1]))
+    def simulate(self, innovations: np.ndarray, segment_length: Optional[int] = None,
+                 statistics: Optional[PathStatistics] = None) -> List[StateT]:
+        """ Simulate paths from pre-generated innovations and return the slices at instrument event dates """
+        observed = self.observe(innovations, segment_length, statistics)
+        return [observed[idx] for idx in self._instrument_indices]
 
-        # Prepare innovations
-        key = jx.random.PRNGKey(seed)
-        innovations = jx.random.normal(key, (len(dts), num_paths), dtype=np.float32)
+    def observe(self, innovations: np.ndarray, segment_length: Optional[int] = None,
+                statistics: Optional[PathStatistics] = None) -> Dict[int, StateT]:
+        """
+        Simulate paths and return the slices at instrument event dates keyed by grid index. Steps between two event
+        dates run inside one lax.scan so only the event slices are materialized and the trace size does not grow with
+        the number of steps. Path statistics are carried through the same scans, updated after every step, and
+        observed together with the state. See scan_steps for segment_length
+        """
+        dts = self.time_steps().astype(innovations.dtype)
+        state = self._initial_state(innovations.shape[-1], innovations.dtype)
+        initial, update = (lambda _: {}, None) if statistics is None else statistics
+        carry = (state, initial(state))
 
-        # Simulate and organize data
-        slices = self._generate_slices(dts, innovations)
-        grids = []
-        for idx in self._instrument_indices:
-            slices[idx]['time'] = self.schedule[idx]
-            grids.append(slices[idx])
-        return grids
+        def step(carry: Tuple[StateT, StateT],
+                 inputs: Tuple[np.ndarray, np.ndarray]) -> Tuple[Tuple[StateT, StateT], None]:
+            prev, values = carry
+            curr = self._step(prev, *inputs)
+            return (curr, values if update is None else update(values, prev, curr, inputs[0])), None
+
+        observed = {}
+        start = 0
+        for end in sorted(set(self._instrument_indices)):
+            with jx.named_scope('simulate'):
+                carry = scan_steps(step, carry, (dts[start: end + 1], innovations[start: end + 1]), segment_length)
+            observed[end] = {**carry[0], **carry[1], 'time': self.schedule[end]}
+            start = end + 1
+        return observed
+
+    def populate_grids(self, num_paths: int, seed: int, source: Optional[InnovationSource] = None,
+                       cache: Optional[InnovationCache] = None, dtype: np.dtype = np.float32) -> List[StateT]:
+        return self.simulate(self.generate_innovations(num_paths, seed, source, cache, dtype))
+
+    @abc.abstractmethod
+    def _get_required_schedule(self, expiration) -> Union[Tuple[float, ...], np.ndarray]:
+        """ Return required grid given expiration. Return a vector rather than a tuple for fine grids """
 
     @abc.abstractmethod
-    def _get_required_schedule(self, expiration) -> Tuple[float]:
-        """ Return required grid given expiration """
+    def _initial_state(self, num_paths: int, dtype: np.dtype) -> StateT:
+        """ State at t=0. Path-wise variables should already have shape (num_paths,) """
 
     @abc.abstractmethod
-    def _generate_slices(self, dts: Tuple[float], innovations: np.ndarray) -> List[Dict[str, np.ndarray]]:
-        """ Generate paths for all variables. Convention is that we include the t=0 slice """
+    def _step(self, state: StateT, dt: float, innovation: np.ndarray) -> StateT:
+        """ Transition over one step of length dt. innovation has shape (num_factors, num_paths) """
+
+
+def scan_steps(step: Callable, state: Any, inputs: Tuple[np.ndarray, ...], segment_length: Optional[int] = None) -> Any:
+    """
+    Final state of lax.scan of step over inputs. Reverse mode keeps the state of every step for all paths. With
+    segment_length, steps run in checkpointed segments instead, so only the states at segment boundaries are kept and
+    the steps of one segment are recomputed at a time during the backward sweep. Segments of about the square root of
+    the number of steps make memory grow like that square root, for the cost of one more forward pass
+    """
+    num_steps = len(inputs[0])
+    if not segment_length or num_steps <= segment_length:
+        return lax.scan(step, state, inputs)[0]
+
+    @jx.checkpoint
+    def segment(carry: Any, segment_inputs: Tuple[np.ndarray, ...]) -> Tuple[Any, None]:
+        return lax.scan(step, carry, segment_inputs)[0], None
+
+    num_segments = num_steps // segment_length
+    split = num_segments * segment_length
+    segments = tuple(x[:split].reshape((num_segments, segment_length) + x.shape[1:]) for x in inputs)
+    state, _ = lax.scan(segment, state, segments)
+    return lax.scan(step, state, tuple(x[split:] for x in inputs))[0]
+
+
+def build_layout(instrument_schedule: Sequence[float], required_schedule: Sequence[float]) -> ScheduleLayout:
+    """
+    Sort time points and merge duplicates. Instrument time points come first in the concatenated ordering. Points are
+    compared in the dtype the schedule is stored in, so that dates only distinct in double precision are merged
+    instead of becoming a zero length step
+    """
+    dtype = np.asarray(0.0).dtype
+    try:
+        time_points = numpy.concatenate([numpy.asarray(instrument_schedule, dtype=float),
+                                         numpy.ravel(numpy.asarray(required_schedule, dtype=float))])
+        time_points = time_points.astype(dtype).tolist()
+    except jx.errors.JAXTypeError:
+        # Traced under eager autodiff. Comparisons still work as long as they are between identical tracers
+        time_points = list(instrument_schedule) + list(required_schedule)
+
+    order = sorted(range(len(time_points)), key=lambda idx: time_points[idx])
+    grid_sources = []
+    positions = {}
+    for idx in order:
+        if not grid_sources or time_points[idx] != time_points[grid_sources[-1]]:
+            grid_sources.append(idx)
+        positions[idx] = len(grid_sources) - 1
+    return tuple(grid_sources), tuple(positions[idx] for idx in range(len(instrument_schedule)))
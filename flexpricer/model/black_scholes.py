@@ -1,11 +1,11 @@
 """
 Black Scholes model
 """
-from typing import List, Tuple, Dict
+from typing import Tuple
 from dataclasses import dataclass
 from jax import numpy as np
 
-from flexpricer.model.base_model import Model
+from flexpricer.model.base_model import Model, StateT
 
 
 @dataclass
@@ -19,14 +19,11 @@ class BlackScholes(Model):
     def _get_required_schedule(self, expiration) -> Tuple[float]:
         return (expiration,)
 
-    def _generate_slices(self, dts: Tuple[float], innovations: np.ndarray) -> List[Dict[str, np.ndarray]]:
-        grid = []
-        spot = np.array(self.spot)
-        drift = self.rate - self.dividend - 0.5 * self.volatility ** 2
-        numeraire = np.array(1.0)
-        for dt, innovation in zip(dts, innovations):
-            numeraire = numeraire * np.exp(self.rate * dt)
-            spot = spot * np.exp(drift * dt + self.volatility * np.sqrt(dt) * innovation)
-            grid.append({'spot': spot, 'numeraire': numeraire})
+    def _initial_state(self, num_paths: int, dtype: np.dtype) -> StateT:
+        return {'spot': self.spot * np.ones(num_paths, dtype=dtype), 'numeraire': np.ones((), dtype=dtype)}
 
-        return grid
+    def _step(self, state: StateT, dt: float, innovation: np.ndarray) -> StateT:
+        drift = self.rate - self.dividend - 0.5 * self.volatility ** 2
+        numeraire = state['numeraire'] * np.exp(self.rate * dt)
+        spot = state['spot'] * np.exp(drift * dt + self.volatility * np.sqrt(dt) * innovation[0])
+        return {'spot': spot, 'numeraire': numeraire}
@@ -1,46 +1,98 @@
 """
-Heston stochastic volatility model
+Heston stochastic volatility model with Andersen's quadratic-exponential (QE) scheme. Parameters follow
+flexpricer.analytical.HestonPhi
 """
-from typing import List, Tuple, Dict
+from typing import ClassVar
 from dataclasses import dataclass
 from jax import numpy as np
+from jax.scipy.special import log_ndtr
 
-from flexpricer.model.base_model import Model
+from flexpricer.model.base_model import Model, StateT
+
+# Switching level of psi between the quadratic and the exponential variance sample
+PSI_CRITICAL = 1.5
 
 
 @dataclass
 class Heston(Model):
+    """
+    Variance is sampled from a moment matched quadratic or exponential distribution and log spot with the martingale
+    corrected central discretization of Andersen (2008), so a few steps per year are enough. Innovation factor 0
+    drives variance and factor 1 the independent part of spot
+    """
 
     spot: float
     rate: float
     dividend: float
-    volatility: float
-    vbar: float
-    kappa: float
-    eta: float
-
-    def _get_required_schedule(self, expiration) -> Tuple[float]:
-        return (expiration,)
-
-    def _generate_slices(self, dts: Tuple[float], innovations: np.ndarray) -> List[Dict[str, np.ndarray]]:
-        grid = []
-        spot = np.array(self.spot)
-        new_var = np.array(self.volatility ** 2)
-        carry = self.rate - self.dividend
-        numeraire = np.array(1.0)
-        for dt, innovation in zip(dts, innovations):
-            # Book keeping
-            var = new_var
-
-            # Numeraire
-            numeraire = numeraire * np.exp(self.rate * dt)
-
-            # Variance process
-            v2 = np.maximum(var, 0)
-            new_var = var - self.kappa * (v2 - self.vbar) * dt + self.eta * np.sqrt(v2 * dt) * innovation[0]
-
-            # Spot process
-            spot = spot * np.exp(carry * dt - (var + new_var) / 4 * dt + np.sqrt(v2 * dt) * innovation[1])
-            grid.append({'spot': spot, 'variance': new_var, 'numeraire': numeraire})
-
-        return grid
+    v0: float  # Beginning variance
+    vbar: float  # Long term variance level
+    kappa: float  # Reversion
+    eta: float  # vol of variance
+    rho: float  # spot-variance correlation
+
+    # Equally spaced steps up to expiration, merged with instrument dates
+    num_steps: ClassVar[int] = 8
+
+    @property
+    def num_factors(self) -> int:
+        return 2
+
+    def _get_required_schedule(self, expiration) -> np.ndarray:
+        # Fractions first so that the last point is expiration itself, as stored for the event date
+        return expiration * (np.arange(1, self.num_steps + 1) / self.num_steps)
+
+    def _initial_state(self, num_paths: int, dtype: np.dtype) -> StateT:
+        return {'spot': self.spot * np.ones(num_paths, dtype=dtype),
+                'variance': self.v0 * np.ones(num_paths, dtype=dtype),
+                'numeraire': np.ones((), dtype=dtype)}
+
+    def _step(self, state: StateT, dt: float, innovation: np.ndarray) -> StateT:
+        # A zero length step leaves the state unchanged. It is computed on a unit step to keep the unused branch finite
+        step = dt > 0
+        new = self._qe_step(state, np.where(step, dt, 1.0), innovation)
+        return {k: np.where(step, new[k], state[k]) for k in new}
+
+    def _qe_step(self, state: StateT, dt: float, innovation: np.ndarray) -> StateT:
+        var = state['variance']
+        eta2 = self.eta ** 2
+
+        # Numeraire
+        numeraire = state['numeraire'] * np.exp(self.rate * dt)
+
+        # Variance moments over the step
+        decay = np.exp(-self.kappa * dt)
+        mean = self.vbar + (var - self.vbar) * decay
+        variance = (var * eta2 * decay * (1 - decay) + self.vbar * eta2 / 2 * (1 - decay) ** 2) / self.kappa
+        psi = variance / mean ** 2
+
+        # Quadratic sample for small psi. Clipped psi keeps the unused branch finite so gradients stay clean
+        inv_psi = 2 / np.minimum(psi, PSI_CRITICAL)
+        b2 = inv_psi - 1 + np.sqrt(inv_psi * (inv_psi - 1))
+        a = mean / (1 + b2)
+        quadratic_var = a * (np.sqrt(b2) + innovation[0]) ** 2
+
+        # Exponential sample with a point mass at 0 for large psi. 1 - U = Phi(-z) is taken in logs
+        p = (np.maximum(psi, PSI_CRITICAL) - 1) / (np.maximum(psi, PSI_CRITICAL) + 1)
+        beta = (1 - p) / mean
+        log_tail = log_ndtr(-innovation[0])
+        exponential_var = np.where(log_tail < np.log(1 - p), (np.log(1 - p) - log_tail) / beta, 0.0)
+
+        quadratic = psi <= PSI_CRITICAL
+        new_var = np.where(quadratic, quadratic_var, exponential_var)
+
+        # Log spot with trapezoidal variance integral
+        k1 = dt * (self.kappa * self.rho / self.eta - 0.5) / 2 - self.rho / self.eta
+        k2 = dt * (self.kappa * self.rho / self.eta - 0.5) / 2 + self.rho / self.eta
+        k3 = dt * (1 - self.rho ** 2) / 2
+        big_a = k2 + k3 / 2
+
+        # Martingale correction replaces the constant drift term so that E[S(t+dt)] is the exact forward
+        quadratic_k0 = -big_a * b2 * a / (1 - 2 * big_a * a) + 0.5 * np.log(1 - 2 * big_a * a)
+        exponential_k0 = -np.log(p + beta * (1 - p) / (beta - big_a))
+        k0 = np.where(quadratic, quadratic_k0, exponential_k0) - (k1 + k3 / 2) * var
+
+        # Both variances are 0 after the point mass. Keep sqrt away from 0 there so that second order greeks stay finite
+        integrated = var + new_var
+        diffusion = np.where(integrated > 0, np.sqrt(k3 * np.where(integrated > 0, integrated, 1.0)), 0.0)
+        log_return = (self.rate - self.dividend) * dt + k0 + k1 * var + k2 * new_var + diffusion * innovation[1]
+        return {'spot': state['spot'] * np.exp(log_return), 'variance': new_var, 'numeraire': numeraire}
@@ -0,0 +1,155 @@
+"""
+Sources of standard normal innovations. A source returns an array of shape (steps, factors, paths)
+"""
+from typing import Tuple, List, Callable, Dict, Any
+from dataclasses import dataclass
+from functools import lru_cache
+from collections import OrderedDict
+import abc
+import numpy
+import jax.numpy as np
+import jax as jx
+from jax.scipy.special import ndtri
+from scipy.stats import qmc
+
+# Default byte budget of an InnovationCache
+CACHE_BYTES = 1 << 28
+
+
+class InnovationSource(abc.ABC):
+
+    @abc.abstractmethod
+    def generate(self, seed: int, dts: np.ndarray, num_factors: int, num_paths: int, dtype: np.dtype) -> np.ndarray:
+        """ Innovations for a schedule with steps dts. seed selects an independent replicate """
+
+
+@dataclass(frozen=True)
+class PseudoRandom(InnovationSource):
+
+    def generate(self, seed: int, dts: np.ndarray, num_factors: int, num_paths: int, dtype: np.dtype) -> np.ndarray:
+        key = jx.random.PRNGKey(seed)
+        return jx.random.normal(key, (len(dts), num_factors, num_paths), dtype=dtype)
+
+
+@dataclass(frozen=True)
+class SobolBridge(InnovationSource):
+    """
+    Scrambled Sobol points mapped to normals with the inverse CDF. Each seed is an independently scrambled replicate.
+    With bridge, the leading Sobol coordinates build each factor's terminal value and then midpoints, so that most of
+    the path variance sits in the best distributed coordinates. Coordinates are interleaved across factors
+    """
+    bridge: bool = True
+
+    def generate(self, seed: int, dts: np.ndarray, num_factors: int, num_paths: int, dtype: np.dtype) -> np.ndarray:
+        num_steps = len(dts)
+        points = qmc.Sobol(num_steps * num_factors, scramble=True, seed=seed).random(num_paths)
+        # Scrambled points are never exactly 0 but can round to 1 in single precision
+        normals = ndtri(np.clip(np.asarray(points.T, dtype=dtype), 1e-7, 1 - 1e-7))
+        normals = normals.reshape(num_steps, num_factors, num_paths)
+        if not self.bridge or num_steps == 1:
+            return normals
+        return jx.vmap(brownian_bridge, in_axes=(1, None), out_axes=1)(normals, dts.astype(dtype))
+
+
+@dataclass(frozen=True)
+class Antithetic(InnovationSource):
+    """ First half of the paths comes from `source`, second half is its mirror image. num_paths must be even """
+    source: InnovationSource = PseudoRandom()
+
+    def generate(self, seed: int, dts: np.ndarray, num_factors: int, num_paths: int, dtype: np.dtype) -> np.ndarray:
+        if num_paths % 2:
+            raise ValueError(f'Antithetic sampling needs an even number of paths, got {num_paths}')
+        half = self.source.generate(seed, dts, num_factors, num_paths // 2, dtype)
+        return np.concatenate([half, -half], axis=-1)
+
+
+class InnovationCache:
+    """
+    LRU cache of generated innovations, keyed on (source, seed, dts, num_factors, num_paths, dtype). Least recently
+    used entries are evicted once the cached arrays exceed max_bytes. Innovations for a traced schedule, or generated
+    under a trace, are returned as usual and never cached
+    """
+
+    def __init__(self, max_bytes: int = CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._entries: Dict[Any, np.ndarray] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, source: InnovationSource, seed: int, dts: np.ndarray, num_factors: int, num_paths: int,
+            dtype: np.dtype, generate: Callable[[], np.ndarray]) -> np.ndarray:
+        try:
+            steps = tuple(numpy.asarray(dts, dtype=float).tolist())
+        except jx.errors.JAXTypeError:
+            return generate()
+
+        key = (source, seed, steps, num_factors, num_paths, str(np.dtype(dtype)))
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        innovations = generate()
+        # Inside jit even a concrete schedule gives traced innovations, which must not outlive the trace
+        if not isinstance(innovations, jx.core.Tracer) and innovations.nbytes <= self.max_bytes:
+            while self.bytes + innovations.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+            self._entries[key] = innovations
+            self.bytes += innovations.nbytes
+        return innovations
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._entries),
+                'bytes': self.bytes}
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = self.hits = self.misses = self.evictions = 0
+
+
+@lru_cache()
+def bridge_levels(num_steps: int) -> Tuple[List[Tuple[numpy.ndarray, ...]], int]:
+    """
+    Bisection order of a Brownian bridge on grid points 1..num_steps, 0 being t=0. Each level holds (mid, left, right,
+    rank) arrays so that all midpoints of a level are filled at once
+    """
+    levels = []
+    intervals = [(0, num_steps)]
+    rank = 1
+    while intervals:
+        level = [(left, right) for left, right in intervals if right - left > 1]
+        if not level:
+            break
+        left, right = numpy.array(level).T
+        mid = (left + right) // 2
+        levels.append((mid, left, right, numpy.arange(rank, rank + len(mid))))
+        rank += len(mid)
+        intervals = [pair for l_, m_, r_ in zip(left, mid, right) for pair in ((l_, m_), (m_, r_))]
+    return levels, rank
+
+
+def brownian_bridge(normals: np.ndarray, dts: np.ndarray) -> np.ndarray:
+    """
+    Turn normals of shape (steps, paths) in bridge order into standardized increments, i.e. (W(t_i) - W(t_i-1)) /
+    sqrt(dt_i). Zero length steps get zero increments. Weights are jax operations so dts may be traced
+    """
+    num_steps = len(dts)
+    times = np.concatenate([np.zeros(1, dtype=dts.dtype), np.cumsum(dts)])
+    path = np.zeros((num_steps + 1,) + normals.shape[1:], dtype=normals.dtype)
+    path = path.at[num_steps].set(np.sqrt(times[-1]) * normals[0])
+
+    levels, _ = bridge_levels(num_steps)
+    for mid, left, right, rank in levels:
+        t_left, t_mid, t_right = times[left][:, None], times[mid][:, None], times[right][:, None]
+        # An interval of zero length pins its midpoint to the left end
+        length = np.where(t_right > t_left, t_right - t_left, 1)
+        mean = path[left] + (t_mid - t_left) / length * (path[right] - path[left])
+        path = path.at[mid].set(mean + np.sqrt((t_mid - t_left) * (t_right - t_mid) / length) * normals[rank])
+    positive = (dts > 0)[:, None]
+    return np.where(positive, np.diff(path, axis=0) / np.sqrt(np.where(positive, dts[:, None], 1)), 0)
+
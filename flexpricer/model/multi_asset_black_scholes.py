@@ -0,0 +1,71 @@
+"""
+Black Scholes model on several correlated assets
+"""
+from typing import Tuple
+from dataclasses import dataclass, field
+import functools
+import numpy
+from jax import numpy as np
+import jax as jx
+
+from flexpricer.model.base_model import Model, StateT
+
+
+@functools.lru_cache(maxsize=64)
+def _concrete_cholesky(correlation: bytes, num_assets: int) -> numpy.ndarray:
+    matrix = numpy.frombuffer(correlation).reshape(num_assets, num_assets)
+    if not numpy.allclose(matrix, matrix.T) or not numpy.allclose(numpy.diag(matrix), 1):
+        raise ValueError('Correlation matrix must be symmetric with a unit diagonal')
+    try:
+        return numpy.linalg.cholesky(matrix)
+    except numpy.linalg.LinAlgError:
+        raise ValueError('Correlation matrix is not positive definite')
+
+
+@dataclass
+class MultiAssetBlackScholes(Model):
+    """
+    spot, dividend and volatility hold one value per asset and the state holds spot with shape (num_assets, num_paths),
+    so asset i is spot[i]. Each step correlates that step's innovations with one matrix product by the Cholesky factor
+    scaled by volatility. The factor is computed once per model, and concrete correlation matrices are validated and
+    factored once per process
+    """
+
+    spot: np.ndarray
+    rate: float
+    dividend: np.ndarray
+    volatility: np.ndarray
+    correlation: np.ndarray  # Shape (num_assets, num_assets)
+
+    _factor: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        try:
+            correlation = numpy.asarray(self.correlation, dtype=float)
+            cholesky = np.asarray(_concrete_cholesky(correlation.tobytes(), len(correlation)))
+        except jx.errors.JAXTypeError:
+            # Traced, e.g. for greeks to correlation
+            cholesky = np.linalg.cholesky(self.correlation)
+        self._factor = np.reshape(np.asarray(self.volatility), (-1, 1)) * cholesky
+
+    @property
+    def num_assets(self) -> int:
+        return len(self._factor)
+
+    @property
+    def num_factors(self) -> int:
+        return self.num_assets
+
+    def _get_required_schedule(self, expiration) -> Tuple[float]:
+        return (expiration,)
+
+    def _initial_state(self, num_paths: int, dtype: np.dtype) -> StateT:
+        spot = np.broadcast_to(np.reshape(np.asarray(self.spot, dtype=dtype), (-1, 1)), (self.num_assets, num_paths))
+        return {'spot': spot, 'numeraire': np.ones((), dtype=dtype)}
+
+    def _step(self, state: StateT, dt: float, innovation: np.ndarray) -> StateT:
+        drift = self.rate - np.asarray(self.dividend) - 0.5 * np.asarray(self.volatility) ** 2
+        numeraire = state['numeraire'] * np.exp(self.rate * dt)
+        diffusion = self._factor.astype(innovation.dtype) @ innovation
+        spot = state['spot'] * np.exp(np.reshape(drift * dt, (-1, 1)) + np.sqrt(dt) * diffusion)
+        return {'spot': spot, 'numeraire': numeraire}
@@ -0,0 +1,143 @@
+"""
+Fast worker startup. Compiled executables can be kept in JAX's persistent compilation cache, and traced pricers can be
+exported to disk with jax.export so that a new process neither traces nor, with the cache, compiles them again.
+
+    python -m flexpricer.persistence products.json --store DIR --cache-dir DIR
+
+precompiles every product of a JSON list, see warm_up. Serialization needs the flatbuffers package
+"""
+from typing import Callable, Any, Dict, List, Optional, Sequence, Tuple
+import argparse
+import functools
+import hashlib
+import json
+import os
+import jax as jx
+from jax import export
+
+from flexpricer import model as models
+from flexpricer import instrument as instruments
+
+
+def enable_persistent_cache(directory: str, min_compile_seconds: float = 0.0) -> None:
+    """ Keep compiled executables in `directory` across processes. By default every compilation is kept """
+    jx.config.update('jax_compilation_cache_dir', directory)
+    jx.config.update('jax_persistent_cache_min_compile_time_secs', min_compile_seconds)
+    jx.config.update('jax_persistent_cache_min_entry_size_bytes', 0)
+
+
+class ExportStore:
+    """
+    Exported pricers on disk. Entries are keyed on the compile signature, which covers model, instrument, schedule,
+    number of paths and dtypes, together with the argument shapes, a hash of the flexpricer source, the JAX version
+    and the backend, so that exports of older code are not loaded
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.loads = 0
+        self.exports = 0
+
+    def get(self, signature: Any, jitted: Callable, args: Sequence[Any]) -> Callable:
+        """ Load the exported function for `signature` and `args`, or export `jitted` on a miss """
+        path = self.path(signature, args)
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                exported = export.deserialize(bytearray(file.read()))
+            self.loads += 1
+        else:
+            exported = export.export(jitted)(*args)
+            os.makedirs(self.directory, exist_ok=True)
+            # Write then rename so that concurrent workers never read a partial file
+            with open(path + f'.{os.getpid()}', 'wb') as file:
+                file.write(exported.serialize())
+            os.replace(path + f'.{os.getpid()}', path)
+            self.exports += 1
+        return jx.jit(exported.call)
+
+    def path(self, signature: Any, args: Sequence[Any]) -> str:
+        key = repr((_describe(signature), argument_key(args), source_hash(), jx.__version__, jx.default_backend()))
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + '.jax')
+
+
+def argument_key(args: Sequence[Any]) -> Tuple:
+    """ Tree structure, shapes and dtypes of args. An exported function only accepts arguments with the same key """
+    leaves, treedef = jx.tree_util.tree_flatten(args)
+    return str(treedef), tuple((jx.numpy.shape(leaf), str(jx.numpy.result_type(leaf))) for leaf in leaves)
+
+
+@functools.lru_cache(maxsize=None)
+def source_hash() -> str:
+    """ Hash of every module of the package. The engine is traced along with models and instruments """
+    package = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for root, dirs, files in sorted(os.walk(package)):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, package).encode())
+                with open(path, 'rb') as file:
+                    digest.update(file.read())
+    return digest.hexdigest()
+
+
+def _describe(value: Any) -> Any:
+    """ Stable description of a signature. Classes are named by module and qualified name instead of their id """
+    if isinstance(value, type):
+        return f'{value.__module__}.{value.__qualname__}'
+    if isinstance(value, tuple):
+        return tuple(_describe(item) for item in value)
+    return value
+
+
+def _number(value: Any) -> Any:
+    """ JSON integers become floats, and lists float arrays, so that params can be differentiated """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, list):
+        return jx.numpy.asarray(value, dtype=float)
+    return value
+
+
+def warm_up(products: List[Dict[str, Any]], store: Optional[ExportStore] = None) -> int:
+    """
+    Compile every product. A product names its model and instrument classes and gives params, and optionally
+    num_paths and a risk entry with the keyword arguments of Pricer.risk except params, seed and vector, plus
+    vector_size. With a store, pricers are exported as well. Returns the number of compiled functions
+    """
+    from flexpricer.engine import Pricer
+
+    count = 0
+    for product in products:
+        pricer = Pricer(getattr(models, product['model']), getattr(instruments, product['instrument']),
+                        num_paths=product.get('num_paths', 100000), store=store)
+        params = {name: _number(value) for name, value in product['params'].items()}
+        pricer.compiled_price(params, 0)
+        count += 1
+        if 'risk' in product:
+            risk = dict(product['risk'])
+            vector = jx.numpy.full(risk.pop('vector_size', 1), params[risk['vector_name']])
+            pricer.risk(params, risk.get('names', []), [tuple(pair) for pair in risk.get('pairs', [])],
+                        risk['vector_name'], vector, 0)
+            count += 1
+    return count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Precompile and export a list of products')
+    parser.add_argument('products', help='JSON file with a list of products, see warm_up')
+    parser.add_argument('--store', help='Directory of exported pricers')
+    parser.add_argument('--cache-dir', help='Directory of the persistent compilation cache')
+    args = parser.parse_args()
+
+    if args.cache_dir:
+        enable_persistent_cache(args.cache_dir)
+    with open(args.products) as file:
+        products = json.load(file)
+    count = warm_up(products, ExportStore(args.store) if args.store else None)
+    print(f'Compiled {count} functions for {len(products)} products')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Price a book of instruments on one set of simulated paths
+"""
+from typing import Dict, Type, List, Tuple, Callable, Optional, NamedTuple, Any
+from dataclasses import dataclass, field
+import numpy
+import jax.numpy as np
+import jax as jx
+
+from flexpricer.model import Model, InnovationSource, PseudoRandom
+from flexpricer.model.base_model import ScheduleLayout, StateT
+from flexpricer.instrument import Instrument
+from flexpricer.compilation import CompileCache, CompiledSignature
+from flexpricer.engine import run_events
+from flexpricer.precision import Precision, SINGLE
+
+
+@dataclass
+class Position:
+    instrument: Type[Instrument]
+    params: Dict[str, float] = field(default_factory=dict)  # Overrides of the book level parameters
+    quantity: float = 1.0
+    settings: Dict[str, Any] = field(default_factory=dict)  # Static fields of the instrument, see PricerComponent
+
+
+@dataclass
+class PortfolioResult:
+    prices: numpy.ndarray  # Unit price per position
+    value: float  # Quantity weighted sum of prices
+    greeks: Dict[str, float]  # Sensitivities of value
+
+
+class _Group(NamedTuple):
+    """ Positions of the same instrument class, settings and number of events are priced together """
+    instrument: Type[Instrument]
+    positions: Tuple[int, ...]
+    num_events: int
+    settings: Tuple[Tuple[str, Any], ...] = ()
+
+
+def _stack(values: List[Optional[float]]) -> Optional[np.ndarray]:
+    """ One parameter across the positions of a group. Optional parameters left as None stay None for the group """
+    if all(value is None for value in values):
+        return None
+    if any(value is None for value in values):
+        raise ValueError('An optional parameter must be given for all positions of an instrument or for none')
+    return np.array(values)
+
+
+class PortfolioPricer:
+    """
+    All positions share one model. Event dates of every position are merged into one schedule, paths are simulated
+    once and each event slice is routed to the positions that observe it. Positions in a group run under one lax.map
+    so the trace size grows with the number of groups, not positions. Instruments with path statistics are not
+    supported
+    """
+
+    def __init__(self, model: Type[Model], positions: List[Position], num_paths: int = 100000,
+                 cache: Optional[CompileCache] = None, innovations: Optional[InnovationSource] = None,
+                 precision: Precision = SINGLE) -> None:
+        self.model_class = model
+        self.positions = positions
+        self.num_paths = num_paths
+        self.cache = CompileCache() if cache is None else cache
+        self.innovations = PseudoRandom() if innovations is None else innovations
+        self.precision = precision
+
+    def price(self, params: Dict[str, float], seed: int) -> PortfolioResult:
+        return self.risk(params, [], seed)
+
+    def risk(self, params: Dict[str, float], names: List[str], seed: int) -> PortfolioResult:
+        """ Per position prices and sensitivities of the book value to model parameters `names` """
+        with self.precision.scope():
+            return self._risk(params, tuple(names), seed)
+
+    def _risk(self, params: Dict[str, float], names: Tuple[str, ...], seed: int) -> PortfolioResult:
+        unknown = set(names) - set(self.model_class.parameters())
+        if unknown:
+            raise ValueError(f'Portfolio greeks are only available for model parameters, got {sorted(unknown)}')
+
+        model, groups, rows = self._initialized_model(params)
+        innovations = model.generate_innovations(self.num_paths, seed, self.innovations, dtype=self.precision.dtype)
+        signature = (CompiledSignature(self.model_class, tuple(groups), tuple(numpy.asarray(model.schedule).tolist()),
+                                       model.layout, self.num_paths, str(innovations.dtype), self.precision),
+                     'portfolio', names)
+        executable = self.cache.get(signature, lambda on_trace: self._compile(model.layout, groups, names, on_trace))
+
+        model_params = {k: params[k] for k in self.model_class.parameters()}
+        sensitive_params = {k: model_params.pop(k) for k in names}
+        quantities = numpy.array([position.quantity for position in self.positions])
+        (value, prices), greeks = executable(sensitive_params, model_params, self._group_params(params, groups), rows,
+                                             quantities, innovations)
+
+        unit_prices = numpy.empty(len(self.positions))
+        for group, group_prices in zip(groups, prices):
+            unit_prices[list(group.positions)] = group_prices
+        return PortfolioResult(unit_prices, float(value), {k: float(v) for k, v in greeks.items()})
+
+    def _instrument_params(self, params: Dict[str, float], position: Position) -> Dict[str, float]:
+        all_params = {**position.instrument.defaults(), **params, **position.params}
+        return {k: all_params[k] for k in position.instrument.parameters()}
+
+    def _initialized_model(self, params: Dict[str, float]) -> Tuple[Model, List[_Group], List[np.ndarray]]:
+        """ Concrete pass that merges event dates and assigns each position's events to grid indices """
+        # noinspection PyArgumentList
+        model = self.model_class(**{k: params[k] for k in self.model_class.parameters()})
+        event_times, event_counts, grouped = [], [], {}
+        for idx, position in enumerate(self.positions):
+            unknown = set(position.settings) - set(position.instrument.settings())
+            if unknown:
+                raise ValueError(f'Unknown settings {sorted(unknown)} for {position.instrument.__name__}')
+            # noinspection PyArgumentList
+            instrument = position.instrument(**self._instrument_params(params, position), **position.settings)
+            if instrument.path_statistics() is not None or len(instrument.monitoring_schedule()):
+                raise ValueError(f'{position.instrument.__name__} needs path statistics, which books do not carry. '
+                                 f'Price it with Pricer')
+            times = [float(event[0]) for event in instrument.build_forward_events()]
+            event_times.extend(times)
+            event_counts.append(len(times))
+            settings = tuple(sorted(position.settings.items()))
+            grouped.setdefault((position.instrument, settings, len(times)), []).append(idx)
+
+        model.initialize_schedule(tuple(event_times), max(event_times))
+        event_indices = model.layout[1]
+        offsets = numpy.cumsum([0] + event_counts)
+        groups, rows = [], []
+        for (instrument_class, settings, num_events), members in grouped.items():
+            groups.append(_Group(instrument_class, tuple(members), num_events, settings))
+            rows.append(np.array([event_indices[offsets[idx]: offsets[idx + 1]] for idx in members]))
+        return model, groups, rows
+
+    def _group_params(self, params: Dict[str, float], groups: List[_Group]) -> List[Dict[str, np.ndarray]]:
+        stacked = []
+        for group in groups:
+            members = [self._instrument_params(params, self.positions[idx]) for idx in group.positions]
+            stacked.append({k: _stack([member[k] for member in members]) for k in group.instrument.parameters()})
+        return stacked
+
+    def _compile(self, layout: ScheduleLayout, groups: List[_Group], names: Tuple[str, ...],
+                 on_trace: Callable[[], None]) -> Callable:
+
+        def group_event_times(group: _Group, group_params: Dict[str, np.ndarray]) -> np.ndarray:
+            def times(instrument_params: Dict[str, float]) -> np.ndarray:
+                # noinspection PyArgumentList
+                instrument = group.instrument(**instrument_params, **dict(group.settings))
+                return np.stack([event[0] for event in instrument.build_forward_events()])
+            return np.ravel(jx.vmap(times)(group_params))
+
+        def price_group(group: _Group, group_params: Dict[str, np.ndarray], group_rows: np.ndarray,
+                        stacked: StateT) -> np.ndarray:
+            def price_position(inputs: Tuple[Dict[str, float], np.ndarray]) -> float:
+                instrument_params, event_rows = inputs
+                # noinspection PyArgumentList
+                instrument = group.instrument(**instrument_params, **dict(group.settings))
+                grids = [{k: v[event_rows[idx]] for k, v in stacked.items()} for idx in range(group.num_events)]
+                return run_events(instrument.build_forward_events(), instrument.build_backward_events(), grids)
+            return jx.lax.map(price_position, (group_params, group_rows))
+
+        def book(sensitives: Dict[str, float], fixed: Dict[str, float], group_params: List[Dict[str, np.ndarray]],
+                 rows: List[np.ndarray], quantities: np.ndarray, innovations: np.ndarray):
+            # noinspection PyArgumentList
+            model = self.model_class(**sensitives, **fixed)
+
+            # Event times in the same order as the concrete pass: position by position within each group
+            times = [group_event_times(group, group_params[idx]) for idx, group in enumerate(groups)]
+            order = numpy.argsort(numpy.concatenate([numpy.asarray(group.positions).repeat(group.num_events)
+                                                     for group in groups]), kind='stable')
+            instrument_schedule = np.concatenate(times)[order]
+            model.initialize_schedule(instrument_schedule, np.max(instrument_schedule), layout)
+
+            # Stack unique event slices so that positions can look them up by grid index
+            observed = model.observe(innovations)
+            grid_indices = sorted(observed)
+            stacked = {k: np.stack([observed[idx][k] for idx in grid_indices]) for k in observed[grid_indices[0]]}
+            lookup = numpy.zeros(max(grid_indices) + 1, dtype=int)
+            lookup[grid_indices] = numpy.arange(len(grid_indices))
+
+            prices = [price_group(group, group_params[idx], np.asarray(lookup)[rows[idx]], stacked)
+                      for idx, group in enumerate(groups)]
+            value = np.dot(np.concatenate(prices), quantities[numpy.concatenate([group.positions for group in groups])])
+            return value, prices
+
+        def evaluate(*args):
+            on_trace()
+            return jx.value_and_grad(book, has_aux=True)(*args)
+
+        return jx.jit(evaluate)
@@ -0,0 +1,82 @@
+"""
+Numerical precision of simulated paths and of path averages. Instruments reduce paths with path_mean, which follows the
+policy of the pricer that is running
+"""
+from typing import Iterator
+from dataclasses import dataclass
+from contextlib import contextmanager
+from contextvars import ContextVar
+import jax.numpy as np
+import jax as jx
+
+DTYPES = ('float32', 'float64')
+ACCUMULATIONS = ('native', 'pairwise', 'float64')
+
+
+@dataclass(frozen=True)
+class Precision:
+    """
+    dtype of innovations and paths, and how path averages are accumulated
+    * native: mean in the path dtype
+    * pairwise: pairwise summation in the path dtype, so rounding error grows with log(num_paths)
+    * float64: paths are cast to float64 before averaging
+    Policies that need float64 enable x64 while the pricer runs, so it does not have to be enabled globally
+    """
+    dtype: str = 'float32'
+    accumulation: str = 'native'
+
+    def __post_init__(self) -> None:
+        if self.dtype not in DTYPES:
+            raise ValueError(f'Unknown path dtype {self.dtype}, expected one of {DTYPES}')
+        if self.accumulation not in ACCUMULATIONS:
+            raise ValueError(f'Unknown accumulation {self.accumulation}, expected one of {ACCUMULATIONS}')
+
+    @property
+    def needs_x64(self) -> bool:
+        return self.dtype == 'float64' or self.accumulation == 'float64'
+
+    @contextmanager
+    def scope(self) -> Iterator[None]:
+        """ Make this the policy of path_mean, and enable x64 if needed, for the duration of the block """
+        token = _ACTIVE.set(self)
+        try:
+            if self.needs_x64:
+                with jx.enable_x64(True):
+                    yield
+            else:
+                yield
+        finally:
+            _ACTIVE.reset(token)
+
+
+# Common policies
+SINGLE = Precision()
+PAIRWISE = Precision('float32', 'pairwise')
+MIXED = Precision('float32', 'float64')
+DOUBLE = Precision('float64')
+
+_ACTIVE: ContextVar = ContextVar('precision', default=SINGLE)
+
+
+def active_precision() -> Precision:
+    return _ACTIVE.get()
+
+
+def path_mean(values: np.ndarray) -> np.ndarray:
+    """ Average over the path axis, the last one, with the active policy """
+    accumulation = _ACTIVE.get().accumulation
+    if accumulation == 'float64':
+        return np.mean(values.astype(np.float64), axis=-1)
+    if accumulation == 'pairwise':
+        return pairwise_sum(values) / values.shape[-1]
+    return np.mean(values, axis=-1)
+
+
+def pairwise_sum(values: np.ndarray) -> np.ndarray:
+    """ Sum over the last axis by repeatedly adding its two halves. Odd lengths are padded with a zero """
+    while values.shape[-1] > 1:
+        if values.shape[-1] % 2:
+            values = np.concatenate([values, np.zeros(values.shape[:-1] + (1,), dtype=values.dtype)], axis=-1)
+        half = values.shape[-1] // 2
+        values = values[..., :half] + values[..., half:]
+    return values[..., 0]
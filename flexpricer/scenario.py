@@ -0,0 +1,132 @@
+"""
+Scenario and ladder risk. A grid of named parameter axes, or an explicit list of scenarios, is evaluated by one compiled
+function vmapped over scenarios, with every scenario priced on the same innovations
+"""
+from typing import Dict, List, Sequence, Tuple, Callable, Any
+from dataclasses import dataclass, field
+import itertools
+import math
+import numpy
+import jax.numpy as np
+import jax as jx
+
+from flexpricer.engine import Pricer
+from flexpricer.instrumentation import scope as instrumented
+from flexpricer.model.base_model import ScheduleLayout
+
+# Memory budget of one batch of scenarios
+SCENARIO_BYTES = 1 << 30
+
+
+@dataclass
+class ScenarioResult:
+    """ price and each greek have one dimension per axis, in the order of axes """
+    axes: Dict[str, numpy.ndarray]
+    price: numpy.ndarray
+    greeks: Dict[str, numpy.ndarray] = field(default_factory=dict)
+
+    def at(self, **labels: float) -> float:
+        """ Price at the grid point with these axis values """
+        index = tuple(int(numpy.flatnonzero(numpy.isclose(values, labels[name]))[0])
+                      for name, values in self.axes.items())
+        return float(self.price[index])
+
+
+class ScenarioEngine:
+    """
+    Scenarios override pricing parameters of a base parameter set. A grid is flattened into its points, which is the
+    same as nesting one vmap per axis, so that it can be split into batches that fit max_bytes. Batches are padded to
+    one power of two size and share one executable. Innovations are drawn once for the schedule of the base
+    parameters, and axes must not change the ordering of event dates
+    """
+
+    def __init__(self, pricer: Pricer, max_bytes: int = SCENARIO_BYTES) -> None:
+        self.pricer = pricer
+        self.max_bytes = max_bytes
+
+    def grid(self, params: Dict[str, float], axes: Dict[str, Sequence[float]], seed: int,
+             names: Sequence[str] = ()) -> ScenarioResult:
+        """ Price, and first order greeks to `names`, over the Cartesian product of axes """
+        axes = {name: numpy.asarray(values, dtype=float) for name, values in axes.items()}
+        points = numpy.array(list(itertools.product(*axes.values()))).reshape(-1, len(axes))
+        shape = tuple(len(values) for values in axes.values())
+        price, greeks = self._evaluate(params, {name: points[:, idx] for idx, name in enumerate(axes)}, seed,
+                                       tuple(names))
+        return ScenarioResult(axes, price.reshape(shape), {k: v.reshape(shape) for k, v in greeks.items()})
+
+    def scenarios(self, params: Dict[str, float], scenarios: List[Dict[str, float]], seed: int,
+                  names: Sequence[str] = ()) -> ScenarioResult:
+        """ Same as grid for an explicit list. Parameters missing from a scenario keep their base value """
+        if not scenarios:
+            raise ValueError('Expected at least one scenario')
+        keys = list(dict.fromkeys(key for scenario in scenarios for key in scenario))
+        overrides = {key: numpy.array([scenario.get(key, params[key]) for scenario in scenarios], dtype=float)
+                     for key in keys}
+        price, greeks = self._evaluate(params, overrides, seed, tuple(names))
+        return ScenarioResult({'scenario': numpy.arange(len(scenarios))}, price, greeks)
+
+    def _evaluate(self, params: Dict[str, float], overrides: Dict[str, numpy.ndarray], seed: int,
+                  names: Tuple[str, ...]) -> Tuple[numpy.ndarray, Dict[str, numpy.ndarray]]:
+        pricer = self.pricer
+        if not overrides:
+            raise ValueError('Expected at least one scenario axis')
+        clash = set(names) & set(overrides)
+        if clash:
+            raise ValueError(f'Cannot take greeks to scenario axes {sorted(clash)}')
+
+        with pricer.precision.scope(), instrumented(pricer.instrumentation):
+            model = pricer.initialized_model(params)
+            for name, values in overrides.items():
+                for value in numpy.unique(values):
+                    if pricer.initialized_model({**params, name: float(value)}).layout != model.layout:
+                        raise ValueError(f'Scenario axis {name} changes the ordering of event dates at {value}')
+
+            innovations = pricer.draw_innovations(model, seed)
+            num_scenarios = len(next(iter(overrides.values())))
+            batch_size = self.batch_size(model, len(names), num_scenarios)
+            selected = pricer.select(params)
+            sensitives = {name: selected[name] for name in names}
+            fixed = {k: v for k, v in selected.items() if k not in names and k not in overrides}
+            key = ('scenario', tuple(overrides), names, batch_size)
+
+            prices, greeks = [], {name: [] for name in names}
+            for start in range(0, num_scenarios, batch_size):
+                count = min(batch_size, num_scenarios - start)
+                # Overrides follow the path dtype, so that x64 does not promote the paths
+                batch = {k: np.asarray(_pad(v[start: start + count], batch_size), dtype=pricer.precision.dtype)
+                         for k, v in overrides.items()}
+                args = (sensitives, fixed, batch, innovations)
+                executable = pricer.executable(model, key, lambda on_trace: self._compile(model.layout, names,
+                                                                                          on_trace), args)
+                batch_prices, batch_greeks = executable(*args)
+                prices.append(numpy.asarray(batch_prices)[:count])
+                for name in names:
+                    greeks[name].append(numpy.asarray(batch_greeks[name])[:count])
+        return numpy.concatenate(prices), {name: numpy.concatenate(values) for name, values in greeks.items()}
+
+    def batch_size(self, model: Any, num_sensitivities: int, num_scenarios: int) -> int:
+        """ Largest power of two number of scenarios within the memory budget, and no more than needed """
+        per_scenario = self.pricer.bytes_per_path(model, num_sensitivities) * self.pricer.num_paths
+        fits = 2 ** int(math.log2(max(self.max_bytes // per_scenario, 1)))
+        return min(fits, 2 ** math.ceil(math.log2(num_scenarios)))
+
+    def _compile(self, layout: ScheduleLayout, names: Tuple[str, ...], on_trace: Callable[[], None]) -> Callable:
+        pricer = self.pricer
+
+        def evaluate(sensitives: Dict[str, float], fixed: Dict[str, float], overrides: Dict[str, np.ndarray],
+                     innovations: np.ndarray):
+            on_trace()
+
+            def one(override: Dict[str, float]):
+                def price(x: Dict[str, float]) -> float:
+                    return pricer.price_paths({**fixed, **x, **override}, innovations, layout)
+                return jx.value_and_grad(price)(sensitives) if names else (price(sensitives), {})
+
+            return jx.vmap(one)(overrides)
+
+        return jx.jit(evaluate)
+
+
+def _pad(values: numpy.ndarray, size: int) -> numpy.ndarray:
+    """ Repeat the last value up to size """
+    return numpy.concatenate([values, numpy.repeat(values[-1:], size - len(values))])
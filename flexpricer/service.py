@@ -0,0 +1,114 @@
+"""
+Asyncio pricing service. Concurrent requests are queued and coalesced into one vmapped compiled call per group of
+requests that share model, instrument, schedule and greeks
+"""
+from typing import Dict, List, Tuple, Type, Sequence, Any, Optional
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+
+from flexpricer.model import Model
+from flexpricer.instrument import Instrument
+from flexpricer.engine import Pricer
+from flexpricer.compilation import CompileCache
+
+# Largest number of requests per call and the longest a request waits for others to join it, in seconds
+MAX_BATCH_SIZE = 64
+MAX_WAIT = 0.002
+
+
+class PricingService:
+    """
+    A group is priced as soon as it holds max_batch_size requests, or max_wait after its first request arrived.
+    Batches are padded to max_batch_size so that each group compiles once. Pricing runs on one worker thread, so the
+    event loop keeps accepting requests while a batch is evaluated. Every request of a service uses the same seed
+    """
+
+    def __init__(self, num_paths: int = 100000, seed: int = 0, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait: float = MAX_WAIT, cache: Optional[CompileCache] = None) -> None:
+        self.num_paths = num_paths
+        self.seed = seed
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.cache = CompileCache() if cache is None else cache
+        self._pricers: Dict[Tuple[Type[Model], Type[Instrument]], Pricer] = {}
+        self._pending: Dict[Any, List[Tuple[Dict[str, float], asyncio.Future]]] = {}
+        self._timers: Dict[Any, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.batch_sizes = Counter()
+
+    async def price(self, model: Type[Model], instrument: Type[Instrument], params: Dict[str, float]) -> float:
+        return (await self._submit(model, instrument, params, ()))[0]
+
+    async def risk(self, model: Type[Model], instrument: Type[Instrument], params: Dict[str, float],
+                   names: Sequence[str]) -> Tuple[float, Dict[str, float]]:
+        """ Price and first order greeks to `names` """
+        return await self._submit(model, instrument, params, tuple(names))
+
+    def stats(self) -> Dict[str, Any]:
+        return {'queue_depth': self.queue_depth, 'max_queue_depth': self.max_queue_depth,
+                'batches': sum(self.batch_sizes.values()), 'batch_sizes': dict(sorted(self.batch_sizes.items()))}
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    async def __aenter__(self) -> 'PricingService':
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await asyncio.gather(*self._tasks)
+        self.close()
+
+    async def _submit(self, model: Type[Model], instrument: Type[Instrument], params: Dict[str, float],
+                      names: Tuple[str, ...]) -> Tuple[float, Dict[str, float]]:
+        loop = asyncio.get_running_loop()
+        pricer = self._pricer(model, instrument)
+        key = (model, instrument, pricer.schedule_key(params), names)
+        future = loop.create_future()
+        group = self._pending.setdefault(key, [])
+        group.append((params, future))
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+        if len(group) >= self.max_batch_size:
+            self._flush(key)
+        elif len(group) == 1:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key: Any) -> None:
+        group = self._pending.pop(key, None)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if not group:
+            return
+        self.queue_depth -= len(group)
+        self.batch_sizes[len(group)] += 1
+        task = asyncio.get_running_loop().create_task(self._run(key, group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Any, group: List[Tuple[Dict[str, float], asyncio.Future]]) -> None:
+        model, instrument, _, names = key
+        pricer = self._pricer(model, instrument)
+        try:
+            prices, greeks = await asyncio.get_running_loop().run_in_executor(
+                self._executor, pricer.risk_batch, [params for params, _ in group], list(names), self.seed,
+                self.max_batch_size)
+        except Exception as error:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for idx, (_, future) in enumerate(group):
+            if not future.done():
+                future.set_result((float(prices[idx]), {name: float(greeks[name][idx]) for name in names}))
+
+    def _pricer(self, model: Type[Model], instrument: Type[Instrument]) -> Pricer:
+        if (model, instrument) not in self._pricers:
+            self._pricers[model, instrument] = Pricer(model, instrument, num_paths=self.num_paths, cache=self.cache)
+        return self._pricers[model, instrument]
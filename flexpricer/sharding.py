@@ -0,0 +1,40 @@
+"""
+Split simulated paths across local devices. On CPU, call use_cpu_devices before jax initializes its backend so
+that XLA exposes one device per core
+"""
+from typing import Optional, Sequence
+import numpy
+import jax as jx
+import jax.numpy as np
+from jax.sharding import Mesh, NamedSharding, PartitionSpec
+
+
+def use_cpu_devices(count: int) -> None:
+    """ Expose `count` XLA CPU devices. Has no effect once the backend is initialized """
+    jx.config.update('jax_num_cpu_devices', count)
+
+
+def path_sharding(devices: Optional[Sequence[jx.Device]] = None) -> NamedSharding:
+    """ Sharding of (steps, factors, paths) innovations along paths """
+    devices = jx.local_devices() if devices is None else devices
+    return NamedSharding(Mesh(numpy.array(devices), ('paths',)), PartitionSpec(None, None, 'paths'))
+
+
+def shard_paths(innovations: np.ndarray, devices: Optional[Sequence[jx.Device]] = None) -> np.ndarray:
+    """
+    Place innovations across devices. Values do not change, so results are reproducible whatever the device count.
+    Compiled functions taking sharded innovations are partitioned by XLA, with path averages and their gradients
+    reduced across devices
+    """
+    sharding = path_sharding(devices)
+    check_paths(innovations.shape[-1], sharding.mesh.size)
+    return jx.device_put(innovations, sharding)
+
+
+def check_paths(num_paths: int, num_devices: Optional[int] = None) -> None:
+    """ Paths are split evenly, so num_paths must be a multiple of the number of local devices """
+    num_devices = jx.local_device_count() if num_devices is None else num_devices
+    if num_paths % num_devices:
+        valid = max(num_paths // num_devices, 1) * num_devices
+        raise ValueError(f'{num_paths} paths cannot be split evenly across {num_devices} devices, use a multiple of '
+                         f'{num_devices} such as {valid}')
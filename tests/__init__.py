@@ -0,0 +1,7 @@
+"""
+Tests for flexpricer
+"""
+
+# Black Scholes Vanilla parameters shared by the tests
+PARAMS = {'spot': 100.0, 'volatility': 0.2, 'expiration': 0.25, 'strike': 100.0, 'rate': 0.01, 'dividend': 0.0,
+          'smooth': 0.01}
@@ -2,8 +2,12 @@
 Tests for analytical functions
 """
 import numpy as np
+import jax
 
-from flexpricer.analytical import price_bs_call, price_bs_put, price_call_with_phi, BlackScholesPhi, HestonPhi
+from flexpricer import analytical_jax
+from flexpricer.analytical import price_bs_call, price_bs_put, price_call_with_phi, price_calls_with_fft, \
+    BlackScholesPhi, HestonPhi
+from flexpricer.analytical_bs import bs_greeks, implied_vol
 
 
 def test_black_scholes():
@@ -57,3 +61,86 @@ def test_heston_characteristic():
     assert phi(-1j) == 1
     params = {'v0': v0, 'vbar': vbar, 'kappa': kappa, 'eta': eta, 'rho': rho}
     assert abs(price_call_with_phi(HestonPhi, s, k, r, q, t, params) - 1.755695266) < 1e-9
+
+
+def test_fft_pricer():
+    """ Benchmark FFT strike grid against Black Scholes formula and per-strike Heston integration """
+    s = 100
+    r = 0.02
+    q = 0.01
+    t = 0.25
+    strikes = np.linspace(50, 150, 11)
+
+    prices = price_calls_with_fft(BlackScholesPhi, s, strikes, r, q, t, {'sig': 0.2})
+    assert np.abs(prices - price_bs_call(s, strikes, r, q, 0.2, t)).max() < 1e-6
+
+    params = {'v0': 0.04, 'vbar': 0.04, 'kappa': 1.15, 'eta': 0.39, 'rho': -0.64}
+    prices = price_calls_with_fft(HestonPhi, s, strikes, r, q, t, params)
+    expected = [price_call_with_phi(HestonPhi, s, k, r, q, t, params) for k in strikes]
+    assert np.abs(prices - expected).max() < 1e-6
+
+
+def test_jax_phi_pricer():
+    """ Fixed node JAX pricer against adaptive quad on a surface, and its gradients against bumps """
+    s = 100
+    r = 0.02
+    q = 0.01
+    strikes = np.array([80.0, 100.0, 120.0])
+    maturities = np.array([0.25, 1.0])
+    params = {'v0': 0.04, 'vbar': 0.05, 'kappa': 1.15, 'eta': 0.39, 'rho': -0.64}
+
+    price_fn = jax.jit(lambda p: analytical_jax.price_calls_with_phi(HestonPhi, s, strikes, maturities,
+                                                                     r, q, p))
+    prices = price_fn(params)
+    for i, t in enumerate(maturities):
+        for j, k in enumerate(strikes):
+            assert abs(prices[i, j] - price_call_with_phi(HestonPhi, s, k, r, q, t, params)) < 1e-4
+
+    _, greeks = analytical_jax.call_sensitivities(HestonPhi, s, strikes, maturities, r, q, params,
+                                                  ['v0', 'rho'])
+    for name in ('v0', 'rho'):
+        bump = 1e-3
+        up = price_call_with_phi(HestonPhi, s, 100.0, r, q, 1.0, {**params, name: params[name] + bump})
+        down = price_call_with_phi(HestonPhi, s, 100.0, r, q, 1.0, {**params, name: params[name] - bump})
+        assert abs(greeks[name][1, 1] - (up - down) / (2 * bump)) < 1e-2
+
+
+def test_bs_greeks():
+    """ Closed form greeks against automatic differentiation of the price, for calls and puts at once """
+    jax.config.update('jax_enable_x64', True)
+    try:
+        def price(s, sig, call):
+            total_vol = sig * jax.numpy.sqrt(0.5)
+            d1 = (jax.numpy.log(s / 95.0) + 0.01 * 0.5) / total_vol + 0.5 * total_vol
+            norm_cdf = jax.scipy.stats.norm.cdf
+            value = s * jax.numpy.exp(-0.01 * 0.5) * norm_cdf(d1) - 95.0 * jax.numpy.exp(-0.02 * 0.5) * \
+                norm_cdf(d1 - total_vol)
+            return value if call else value - s * jax.numpy.exp(-0.01 * 0.5) + 95.0 * jax.numpy.exp(-0.02 * 0.5)
+
+        greeks = bs_greeks(100.0, 95.0, 0.02, 0.01, 0.25, 0.5, np.array([True, False]))
+        for idx, call in enumerate((True, False)):
+            assert abs(greeks.price[idx] - price(100.0, 0.25, call)) < 1e-12
+            assert abs(greeks.delta[idx] - jax.grad(price)(100.0, 0.25, call)) < 1e-12
+            assert abs(greeks.gamma[idx] - jax.grad(jax.grad(price))(100.0, 0.25, call)) < 1e-12
+            assert abs(greeks.vega[idx] - jax.grad(price, 1)(100.0, 0.25, call)) < 1e-10
+            assert abs(greeks.volga[idx] - jax.grad(jax.grad(price, 1), 1)(100.0, 0.25, call)) < 1e-10
+            assert abs(greeks.vanna[idx] - jax.grad(jax.grad(price), 1)(100.0, 0.25, call)) < 1e-10
+    finally:
+        jax.config.update('jax_enable_x64', False)
+
+
+def test_implied_vol():
+    """ Round trip over a wide range of strikes, vols and maturities, with both option types """
+    rng = np.random.default_rng(0)
+    size = 100000
+    strikes = 100 * np.exp(rng.uniform(-1, 1, size))
+    vols = rng.uniform(0.05, 1.0, size)
+    maturities = rng.uniform(0.05, 3.0, size)
+    calls = rng.uniform(size=size) < 0.5
+    prices = bs_greeks(100.0, strikes, 0.03, 0.01, vols, maturities, calls).price
+
+    solved = implied_vol(prices, 100.0, strikes, 0.03, 0.01, maturities, calls)
+    # Vol is not identified once the time value is lost in rounding of the price
+    identified = bs_greeks(100.0, strikes, 0.03, 0.01, vols, maturities).vega > 1e-4
+    assert np.max(np.abs(solved - vols)[identified]) < 1e-8
+    assert np.isnan(implied_vol(np.array([0.0, 200.0]), 100.0, 100.0, 0.0, 0.0, 1.0)).all()
@@ -0,0 +1,55 @@
+"""
+Tests for headless batch pricing
+"""
+import os
+import sys
+import csv
+import json
+import subprocess
+
+from flexpricer.model import BlackScholes
+from flexpricer.instrument import Vanilla, Digital
+from flexpricer.engine import Pricer
+from flexpricer.precision import MIXED
+from flexpricer.batch import BatchRunner, ResultWriter, read_records
+from tests import PARAMS
+
+
+def test_batch_runner(tmp_path):
+    """ Records are grouped by signature and every price matches compiled_price on the same seed """
+    records = [{**PARAMS, 'strike': 90.0 + idx, 'expiration': (0.25, 0.5)[idx % 2]} for idx in range(12)]
+    records[3]['instrument'] = 'Digital'
+    with open(tmp_path / 'scenarios.jsonl', 'w') as file:
+        file.writelines(json.dumps(record) + '\n' for record in records)
+
+    runner = BatchRunner(num_paths=4096, max_bytes=4 * 4096 * 9 * 4, model='BlackScholes', instrument='Vanilla')
+    with ResultWriter(str(tmp_path / 'prices.csv')) as writer:
+        assert runner.run(read_records(str(tmp_path / 'scenarios.jsonl')), writer) == 12
+    # Two schedules for Vanilla and one for Digital. Full batches hold 4 records and the last batch of a schedule is
+    # padded to the next power of two: 4 + 2 Vanilla records at 0.25, 4 + 1 at 0.5 and one Digital
+    assert runner.cache.stats()['misses'] == 5
+
+    with open(tmp_path / 'prices.csv') as file:
+        rows = {row['id']: row for row in csv.DictReader(file)}
+    for idx, record in enumerate(records):
+        instrument = Digital if idx == 3 else Vanilla
+        params = {k: v for k, v in record.items() if k != 'instrument'}
+        expected = Pricer(BlackScholes, instrument, num_paths=4096).compiled_price(params, 0)
+        assert rows[str(idx)]['instrument'] == instrument.__name__
+        assert abs(float(rows[str(idx)]['price']) - expected) < 1e-5
+
+
+def test_mixed_precision_batch():
+    """ float32 paths with float64 accumulation, where x64 is on while scenarios are stacked """
+    scenarios = [{**PARAMS, 'strike': strike} for strike in (95.0, 100.0, 105.0)]
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=4096, precision=MIXED)
+    prices = pricer.price_batch(scenarios, 0, batch_size=4)
+    for price, scenario in zip(prices, scenarios):
+        assert abs(float(price) - float(pricer.compiled_price(scenario, 0))) < 1e-5
+
+
+def test_headless_import():
+    """ Batch workers do not import plotly """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = 'import sys, flexpricer.batch; assert "plotly" not in sys.modules'
+    subprocess.run([sys.executable, '-c', script], env={**os.environ, 'PYTHONPATH': root}, check=True)
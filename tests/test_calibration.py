@@ -0,0 +1,32 @@
+"""
+Tests for Heston calibration
+"""
+import numpy as np
+
+from flexpricer.analytical import price_call_with_phi, price_bs_call, HestonPhi
+from flexpricer.calibration import HestonCalibrator, Surface
+
+
+def test_heston_calibration():
+    """ Recover parameters from a surface generated by the quad pricer, then warm start on vol quotes """
+    s = 100
+    r = 0.02
+    q = 0.01
+    params = {'v0': 0.05, 'vbar': 0.06, 'kappa': 1.5, 'eta': 0.5, 'rho': -0.7}
+    strikes, maturities = np.meshgrid(np.linspace(80, 120, 5), [0.25, 0.5, 1.0, 2.0])
+    strikes, maturities = strikes.ravel(), maturities.ravel()
+    prices = np.array([price_call_with_phi(HestonPhi, s, k, r, q, t, params) for k, t in zip(strikes, maturities)])
+
+    calibrator = HestonCalibrator(s, r, q)
+    result = calibrator.calibrate(Surface(strikes, maturities, prices))
+    assert result.success
+    assert result.rmse < 1e-4
+    for name, value in params.items():
+        assert abs(result.params[name] - value) < 1e-2
+
+    vols = np.full(len(strikes), 0.2)
+    result = calibrator.calibrate(Surface(strikes, maturities, vols, quote_type='vol'))
+    assert result.success
+    assert result.rmse < 1e-2
+    assert abs(price_call_with_phi(HestonPhi, s, 100, r, q, 1.0, result.params)
+               - price_bs_call(s, 100, r, q, 0.2, 1.0)) < 2e-2
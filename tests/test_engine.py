@@ -0,0 +1,162 @@
+"""
+Tests for the Monte Carlo pricing engine
+"""
+import os
+import sys
+import subprocess
+from typing import ClassVar
+import jax.numpy as np
+
+from flexpricer.model import BlackScholes, Heston
+from flexpricer.instrument import Vanilla
+from flexpricer.engine import Pricer, ControlVariate
+from flexpricer.analytical import price_bs_call
+from flexpricer.instrumentation import Recorder, phase
+from tests import PARAMS
+
+
+def test_compiled_price():
+    """ Compiled pipeline should match the eager one and only trace once per signature """
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=10000)
+    assert abs(pricer.compiled_price(PARAMS, 0) - pricer.unit_price(PARAMS, 0)) < 1e-4
+
+    for strike in (95.0, 105.0):
+        pricer.compiled_price({**PARAMS, 'strike': strike}, 0)
+    assert pricer.cache_info() == {'hits': 2, 'misses': 1, 'retraces': 0, 'size': 1}
+
+    # New expiration is a new schedule
+    pricer.compiled_price({**PARAMS, 'expiration': 0.5}, 0)
+    assert pricer.cache_info()['misses'] == 2
+
+
+def test_innovation_reuse():
+    """ Greek functions with a pinned seed draw innovations once """
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=10000)
+    d1_fn = pricer.generate_d1_fn(PARAMS, ['spot', 'volatility'], 'strike', 0)
+    first = d1_fn(np.array([95.0, 105.0]))
+    second = d1_fn(np.array([95.0, 105.0]))
+    assert (first[0] == second[0]).all()
+    assert pricer.innovation_cache.stats()['misses'] == 1
+    assert pricer.innovation_cache.stats()['hits'] == 1
+
+
+def test_stream_price():
+    """ Streaming result should not depend on how blocks are grouped into chunks """
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=8192)
+    value, grads = pricer.stream_value_and_grad(PARAMS, ['spot'], 0, block_size=1024)
+    for chunk_size in (1024, 3072):
+        assert pricer.stream_value_and_grad(PARAMS, ['spot'], 0, chunk_size=chunk_size, block_size=1024) \
+               == (value, grads)
+    assert abs(value - pricer.unit_price(PARAMS, 0)) < 0.2
+
+    # Memory settings only group seed blocks, so they do not change the paths. Vmapped widths may round differently
+    for max_bytes in (1 << 20, 1 << 24):
+        budget_value, budget_grads = pricer.stream_value_and_grad(PARAMS, ['spot'], 0, max_bytes=max_bytes)
+        assert abs(budget_value - value) < 1e-5 and abs(budget_grads['spot'] - grads['spot']) < 1e-6
+
+    # A short last block when num_paths is not a multiple of the block size
+    uneven = Pricer(BlackScholes, Vanilla, num_paths=5000)
+    value, grads = uneven.stream_value_and_grad(PARAMS, ['spot'], 0, block_size=1024)
+    assert uneven.stream_value_and_grad(PARAMS, ['spot'], 0, chunk_size=2048, block_size=1024) == (value, grads)
+    assert abs(value - uneven.unit_price(PARAMS, 0)) < 0.3
+
+
+def test_risk():
+    """ Fused greeks should agree with the separately built d1/d2 functions """
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=10000)
+    params = {**PARAMS, 'smooth': 2.5}
+    strikes = np.linspace(90, 110, 3)
+    result = pricer.risk(params, ['expiration'], [('spot', 'spot'), ('spot', 'volatility')], 'strike', strikes, 0)
+
+    price, greeks = pricer.generate_d1_fn(params, ['spot', 'expiration'], 'strike', 0)(strikes)
+    assert np.abs(result.price - price).max() < 1e-4
+    assert np.abs(result.first_order['spot'] - greeks['spot']).max() < 1e-5
+    assert np.abs(result.first_order['expiration'] - greeks['expiration']).max() < 1e-4
+    for name1, name2 in [('spot', 'spot'), ('spot', 'volatility')]:
+        expected = pricer.generate_d2_fn(params, name1, name2, 'strike', 0)(strikes)
+        assert np.abs(result.second_order[(name1, name2)] - expected).max() < 1e-5
+
+    # Another strike vector length compiles the same signature again, which counts as a retrace once
+    assert pricer.cache_info()['retraces'] == 0
+    for _ in range(2):
+        pricer.risk(params, ['expiration'], [('spot', 'spot'), ('spot', 'volatility')], 'strike', strikes[:2], 0)
+    assert pricer.cache_info()['retraces'] == 1
+
+
+def test_variance_reduction():
+    """ At-the-money vanilla as control for an out-of-the-money one """
+    params = {**PARAMS, 'strike': 105.0}
+    control = ControlVariate(Vanilla, lambda p: price_bs_call(p['spot'], p['strike'], p['rate'], p['dividend'],
+                                                              p['volatility'], p['expiration']), {'strike': 100.0})
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=2 ** 15, antithetic=True, control_variate=control)
+    report = pricer.reduced_price(params, 0)
+    assert report.variance_reduction > 5
+    assert abs(report.price - price_bs_call(100.0, 105.0, 0.01, 0.0, 0.2, 0.25)) < 4 * report.std_error
+
+
+SHARDED_SCRIPT = """
+import pytest
+from flexpricer.sharding import use_cpu_devices
+use_cpu_devices(4)
+from flexpricer.model import BlackScholes
+from flexpricer.instrument import Vanilla
+from flexpricer.engine import Pricer
+params = %r
+single = Pricer(BlackScholes, Vanilla, num_paths=4096).compiled_price(params, 0)
+sharded = Pricer(BlackScholes, Vanilla, num_paths=4096, shard=True).compiled_price(params, 0)
+assert abs(single - sharded) < 1e-5, (single, sharded)
+with pytest.raises(ValueError, match='such as 4096'):
+    Pricer(BlackScholes, Vanilla, num_paths=4097, shard=True)
+"""
+
+
+def test_sharded_price():
+    """ Sharding paths across devices should not change the result. Needs a fresh process to set the device count """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, 'PYTHONPATH': root}
+    subprocess.run([sys.executable, '-c', SHARDED_SCRIPT % PARAMS], env=env, check=True)
+
+
+def test_instrumentation():
+    """ Compile phases are only reported by the call that compiles. Disabled instrumentation records nothing """
+    recorder = Recorder()
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=10000, instrumentation=recorder)
+    pricer.compiled_price(PARAMS, 0)
+    assert {'initialize', 'generate', 'prepare', 'trace', 'compile', 'execute'} <= set(recorder.totals())
+    # Compilation nests in prepare, which ends before execute starts
+    assert [event.phase for event in recorder.events][-2:] == ['prepare', 'execute']
+
+    recorder.clear()
+    pricer.compiled_price(PARAMS, 1)
+    assert set(recorder.totals()) == {'initialize', 'generate', 'execute'}
+    assert recorder.events[-1].attributes == {'method': 'compiled_price', 'paths': 10000}
+
+    # Outside a pricer call phases are one shared null context
+    assert phase('execute') is phase('generate')
+
+
+def test_checkpointed_risk():
+    """ Checkpointing the simulation changes memory, not the greeks """
+    class FineHeston(Heston):
+        num_steps: ClassVar[int] = 256
+
+    params = {'spot': 100.0, 'rate': 0.02, 'dividend': 0.01, 'v0': 0.04, 'vbar': 0.04, 'kappa': 1.5, 'eta': 0.5,
+              'rho': -0.7, 'expiration': 1.0, 'smooth': 2.5, 'strike': 100.0}
+    strikes = np.linspace(90, 110, 3)
+    results, temp_bytes = [], []
+    for segment_length in (None, 16):
+        pricer = Pricer(FineHeston, Vanilla, num_paths=4096, segment_length=segment_length)
+        results.append(pricer.risk(params, ['v0'], [('spot', 'spot')], 'strike', strikes, 0))
+
+        model = pricer.initialized_model(params)
+        names, fixed = ('v0', 'spot'), {k: v for k, v in pricer.select(params).items() if k not in ('v0', 'spot')}
+        risk = pricer._compile_risk(model.layout, names, (('spot', 'spot'),), 'strike', lambda: None)
+        compiled = risk.lower({name: params[name] for name in names}, fixed, strikes,
+                              pricer.draw_innovations(model, 0)).compile()
+        temp_bytes.append(compiled.memory_analysis().temp_size_in_bytes)
+
+    plain, checkpointed = results
+    assert np.abs(plain.price - checkpointed.price).max() < 1e-4
+    assert np.abs(plain.first_order['v0'] - checkpointed.first_order['v0']).max() < 1e-3
+    assert np.abs(plain.second_order[('spot', 'spot')] - checkpointed.second_order[('spot', 'spot')]).max() < 1e-5
+    assert temp_bytes[1] < temp_bytes[0] / 4
@@ -0,0 +1,170 @@
+"""
+Tests for instruments
+"""
+from typing import ClassVar
+import pytest
+import numpy
+import jax.numpy as np
+from scipy.stats import norm
+
+from flexpricer.model import BlackScholes, MultiAssetBlackScholes, SobolBridge
+from flexpricer.instrument import BermudanPut, Vanilla, Asian, LookbackCall, DownAndOutCall, Basket, WorstOf, BestOf
+from flexpricer.engine import Pricer
+from flexpricer.analytical import price_bs_put, price_bs_call
+
+
+def _tree_bermudan_put(s: float, k: float, r: float, sig: float, t: float, num_exercises: int,
+                       num_steps: int = 2000) -> float:
+    """ CRR binomial tree that only allows exercise at num_exercises equally spaced dates """
+    dt = t / num_steps
+    up = numpy.exp(sig * numpy.sqrt(dt))
+    prob = (numpy.exp(r * dt) - 1 / up) / (up - 1 / up)
+    exercise_steps = {num_steps * idx // num_exercises for idx in range(1, num_exercises + 1)}
+    values = numpy.maximum(k - s * up ** (num_steps - 2 * numpy.arange(num_steps + 1)), 0)
+    for step in range(num_steps - 1, -1, -1):
+        values = numpy.exp(-r * dt) * (prob * values[:-1] + (1 - prob) * values[1:])
+        if step in exercise_steps:
+            values = numpy.maximum(values, k - s * up ** (step - 2 * numpy.arange(step + 1)))
+    return values[0]
+
+
+def test_bermudan_put():
+    """ Longstaff-Schwartz should be close to the lattice and above the European value, in and out of sample """
+    params = {'spot': 100.0, 'rate': 0.05, 'dividend': 0.0, 'volatility': 0.2, 'strike': 105.0, 'expiration': 1.0,
+              'smooth': 0.01, 'coefficients': None}
+    exact = _tree_bermudan_put(100.0, 105.0, 0.05, 0.2, 1.0, BermudanPut.num_exercises)
+    assert exact > price_bs_put(100.0, 105.0, 0.05, 0.0, 0.2, 1.0) + 0.5
+
+    pricer = Pricer(BlackScholes, BermudanPut, num_paths=65536)
+    assert abs(pricer.compiled_price(params, 0) - exact) < 0.1
+
+    coefficients = pricer.fit_exercise(params, 1)
+    assert coefficients.shape == (BermudanPut.num_exercises - 1, BermudanPut.degree + 1)
+    assert abs(pricer.compiled_price({**params, 'coefficients': coefficients}, 0) - exact) < 0.1
+
+
+def test_bermudan_settings():
+    """ Exercise count and regression degree are settings of the pricer, and coefficients may be left out """
+    params = {'spot': 100.0, 'rate': 0.05, 'dividend': 0.0, 'volatility': 0.2, 'strike': 105.0, 'expiration': 1.0,
+              'smooth': 0.01}
+    pricer = Pricer(BlackScholes, BermudanPut, num_paths=65536, settings={'num_exercises': 8, 'degree': 2})
+    assert 'num_exercises' not in pricer.select(params)
+    assert abs(pricer.compiled_price(params, 0) - _tree_bermudan_put(100.0, 105.0, 0.05, 0.2, 1.0, 8)) < 0.1
+    assert pricer.fit_exercise(params, 1).shape == (7, 3)
+    with pytest.raises(ValueError):
+        Pricer(BlackScholes, BermudanPut, settings={'exercises': 8})
+
+
+def test_bermudan_gamma():
+    """ Smoothed exercise values give a pathwise gamma of the size of the European one """
+    params = {'spot': 100.0, 'rate': 0.05, 'dividend': 0.0, 'volatility': 0.2, 'strike': 105.0, 'expiration': 1.0,
+              'smooth': 1.0, 'coefficients': None}
+    pricer = Pricer(BlackScholes, BermudanPut, num_paths=65536)
+    result = pricer.risk(params, [], [('spot', 'spot')], 'strike', np.array([100.0, 105.0]), 0)
+    strikes = numpy.array([100.0, 105.0])
+    d1 = (numpy.log(100.0 / strikes) + 0.05 + 0.02) / 0.2
+    european = norm.pdf(d1) / 20.0
+    assert numpy.abs(numpy.asarray(result.second_order[('spot', 'spot')]) / european - 1).max() < 0.5
+
+
+PATH_PARAMS = {'spot': 100.0, 'rate': 0.03, 'dividend': 0.01, 'volatility': 0.25, 'expiration': 1.0, 'strike': 100.0,
+               'smooth': 0.05, 'barrier': 90.0}
+
+
+def _down_and_out_call(s: float, k: float, b: float, r: float, q: float, sig: float, t: float) -> float:
+    """ Continuously monitored, for k >= b """
+    lam = (r - q + sig ** 2 / 2) / sig ** 2
+    y = numpy.log(b ** 2 / (s * k)) / (sig * numpy.sqrt(t)) + lam * sig * numpy.sqrt(t)
+    knock_in = s * numpy.exp(-q * t) * (b / s) ** (2 * lam) * norm.cdf(y) \
+        - k * numpy.exp(-r * t) * (b / s) ** (2 * lam - 2) * norm.cdf(y - sig * numpy.sqrt(t))
+    return price_bs_call(s, k, r, q, sig, t) - knock_in
+
+
+def test_barrier():
+    """ Discrete monitoring against the continuous price with the Broadie-Glasserman-Kou barrier shift """
+    pricer = Pricer(BlackScholes, DownAndOutCall, num_paths=65536)
+    mean, error = pricer.price_replicates(PATH_PARAMS, range(8))
+    shift = numpy.exp(-0.5826 * 0.25 * numpy.sqrt(1 / DownAndOutCall.num_monitoring))
+    exact = _down_and_out_call(100.0, 100.0, 90.0 * shift, 0.03, 0.01, 0.25, 1.0)
+    assert abs(mean - exact) < 4 * error + 0.02
+
+    # Smoothed survival keeps pathwise greeks finite, and knocking out lowers delta below the vanilla one
+    _, greeks = pricer.generate_d1_fn(PATH_PARAMS, ['spot', 'barrier'], 'strike', 0)(np.array([100.0]))
+    assert 0 < float(greeks['spot'][0]) and float(greeks['barrier'][0]) < 0
+
+
+def test_asian_and_lookback():
+    """ Statistics are carried through the scan: one observed slice whatever the number of monitoring dates """
+    model = BlackScholes(100.0, 0.03, 0.01, 0.25)
+    instrument = Asian(**{k: PATH_PARAMS[k] for k in Asian.parameters()})
+    model.initialize(instrument.build_forward_events(), monitoring=instrument.monitoring_schedule())
+    grids = model.simulate(model.generate_innovations(1000, 0), statistics=instrument.path_statistics())
+    assert len(model.schedule) == Asian.num_monitoring and len(grids) == 1 and grids[0]['integral'].shape == (1000,)
+
+    # An expiration that is not exact in single precision adds no zero length step
+    params = {**PATH_PARAMS, 'expiration': 0.7}
+    instrument = Asian(**{k: params[k] for k in Asian.parameters()})
+    model.initialize(instrument.build_forward_events(), monitoring=instrument.monitoring_schedule())
+    assert len(model.schedule) == Asian.num_monitoring and (numpy.diff(model.schedule) > 0).all()
+    sobol = Pricer(BlackScholes, Asian, num_paths=4096, innovations=SobolBridge())
+    assert numpy.isfinite(sobol.compiled_price(params, 0))
+
+    # Deep in the money the Asian is linear, so its price is the discounted trapezoidal average of forwards
+    pricer = Pricer(BlackScholes, Asian, num_paths=65536)
+    mean, error = pricer.price_replicates({**PATH_PARAMS, 'strike': 50.0}, range(8))
+    times = numpy.linspace(0, 1, Asian.num_monitoring + 1)
+    forwards = 100.0 * numpy.exp(0.02 * times)
+    average = numpy.sum((forwards[1:] + forwards[:-1]) / 2) / Asian.num_monitoring
+    assert abs(mean - numpy.exp(-0.03) * (average - 50.0)) < 4 * error + 1e-3
+
+    # Monitored at expiration only, an out of the money lookback call is a vanilla call
+    class OneDateLookback(LookbackCall):
+        num_monitoring: ClassVar[int] = 1
+
+    params = {**PATH_PARAMS, 'strike': 110.0}
+    lookback = Pricer(BlackScholes, OneDateLookback, num_paths=10000).compiled_price(params, 0)
+    vanilla = Pricer(BlackScholes, Vanilla, num_paths=10000).compiled_price(params, 0)
+    assert abs(lookback - vanilla) < 1e-4
+    assert Pricer(BlackScholes, LookbackCall, num_paths=10000).compiled_price(params, 0) > lookback + 1
+
+
+def test_multi_asset():
+    """ A basket on one asset is a vanilla, and worst-of and best-of bracket the single asset calls """
+    num_assets = 5
+    volatility = numpy.linspace(0.15, 0.35, num_assets)
+    params = {'spot': np.full(num_assets, 100.0), 'rate': 0.03, 'dividend': np.full(num_assets, 0.01),
+              'volatility': np.asarray(volatility), 'correlation': np.asarray(0.5 * numpy.eye(num_assets) + 0.5),
+              'expiration': 1.0, 'strike': 100.0, 'smooth': 0.01, 'weights': np.eye(num_assets)[2],
+              'reference': np.full(num_assets, 100.0)}
+    mean, error = Pricer(MultiAssetBlackScholes, Basket, num_paths=65536).price_replicates(params, range(8))
+    assert abs(mean - price_bs_call(100.0, 100.0, 0.03, 0.01, volatility[2], 1.0)) < 4 * error + 0.01
+
+    calls = price_bs_call(100.0, 100.0, 0.03, 0.01, volatility, 1.0) / 100
+    performance = {**params, 'strike': 1.0}
+    worst = Pricer(MultiAssetBlackScholes, WorstOf, num_paths=65536).compiled_price(performance, 0)
+    best = Pricer(MultiAssetBlackScholes, BestOf, num_paths=65536).compiled_price(performance, 0)
+    assert worst < calls.min() and best > calls.max()
+
+    # Greeks to spot have one entry per asset
+    result = Pricer(MultiAssetBlackScholes, WorstOf, num_paths=65536).risk(performance, ['spot'], [], 'strike',
+                                                                           np.array([0.9, 1.0]), 0)
+    assert result.first_order['spot'].shape == (2, num_assets) and (result.first_order['spot'] > 0).all()
+
+
+def test_basket_gamma():
+    """ Second order greeks to vector parameters come as per-asset blocks """
+    num_assets = 3
+    params = {'spot': np.full(num_assets, 100.0), 'rate': 0.03, 'dividend': np.full(num_assets, 0.01),
+              'volatility': np.full(num_assets, 0.2), 'correlation': np.asarray(0.5 * numpy.eye(num_assets) + 0.5),
+              'expiration': 1.0, 'strike': 100.0, 'smooth': 2.5, 'weights': np.eye(num_assets)[0],
+              'reference': np.full(num_assets, 100.0)}
+    pricer = Pricer(MultiAssetBlackScholes, Basket, num_paths=65536)
+    result = pricer.risk(params, [], [('spot', 'spot'), ('rate', 'spot')], 'strike', np.array([95.0, 105.0]), 0)
+    gamma = numpy.asarray(result.second_order[('spot', 'spot')])
+    assert gamma.shape == (2, num_assets, num_assets) and result.second_order[('rate', 'spot')].shape == (2, 3)
+
+    # Only the first asset is in the basket, so its gamma is the Black Scholes one and the others vanish
+    strikes = numpy.array([95.0, 105.0])
+    d1 = (numpy.log(100.0 / strikes) + 0.02 + 0.02) / 0.2
+    assert numpy.abs(gamma[:, 0, 0] / (numpy.exp(-0.01) * norm.pdf(d1) / 20.0) - 1).max() < 0.1
+    assert numpy.abs(gamma[:, 1:, :]).max() < 1e-6 and numpy.abs(gamma[:, :, 1:]).max() < 1e-6
@@ -0,0 +1,126 @@
+"""
+Tests for Monte Carlo models
+"""
+import numpy
+import pytest
+import jax as jx
+import jax.numpy as np
+
+from flexpricer.model import BlackScholes, Heston, MultiAssetBlackScholes, PseudoRandom, SobolBridge, InnovationCache
+from flexpricer.model.innovations import brownian_bridge
+from flexpricer.instrument import Vanilla
+from flexpricer.engine import Pricer
+from flexpricer.analytical import price_bs_call, price_call_with_phi, HestonPhi
+
+
+def _fine_black_scholes(num_steps: int) -> BlackScholes:
+
+    class FineBlackScholes(BlackScholes):
+        def _get_required_schedule(self, expiration):
+            return expiration * np.arange(1, num_steps + 1) / num_steps
+
+    model = FineBlackScholes(spot=100.0, rate=0.02, dividend=0.01, volatility=0.2)
+    model.initialize(((0.5, None), (1.0, None)))
+    return model
+
+
+def test_scan_engine():
+    """ Only event slices are returned and the trace does not grow with the number of steps """
+    sizes = []
+    for num_steps in (8, 512):
+        model = _fine_black_scholes(num_steps)
+        innovations = model.generate_innovations(1000, 0)
+        assert innovations.shape == (num_steps, 1, 1000)
+
+        grids = model.simulate(innovations)
+        assert [float(grid['time']) for grid in grids] == [0.5, 1.0]
+        assert grids[1]['spot'].shape == (1000,)
+        sizes.append(len(jx.make_jaxpr(model.simulate)(innovations).eqns))
+    assert sizes[0] == sizes[1]
+
+
+def test_sobol_bridge():
+    """ Scrambled Sobol with Brownian bridge should beat pseudo random error on a multi-step vanilla """
+    class FineBlackScholes(BlackScholes):
+        def _get_required_schedule(self, expiration):
+            return expiration * np.arange(1, 9) / 8
+
+    params = {'spot': 100.0, 'volatility': 0.2, 'expiration': 1.0, 'strike': 100.0, 'rate': 0.01, 'dividend': 0.0,
+              'smooth': 0.01}
+    exact = price_bs_call(100.0, 100.0, 0.01, 0.0, 0.2, 1.0)
+    errors = []
+    for source in (PseudoRandom(), SobolBridge()):
+        mean, error = Pricer(FineBlackScholes, Vanilla, 4096, innovations=source).price_replicates(params, range(16))
+        assert abs(mean - exact) < max(4 * error, 5e-3)
+        errors.append(error)
+    assert errors[1] < errors[0] / 10
+
+
+def test_bridge_repeated_time():
+    """ A repeated time point is a zero length step. It gets a zero increment and the others stay standard normal """
+    dts = np.array([0.25, 0.25, 0.0, 0.5])
+    normals = np.asarray(numpy.random.default_rng(0).standard_normal((4, 100000)), dtype=np.float32)
+    increments = brownian_bridge(normals, dts)
+    assert (increments[2] == 0).all() and np.isfinite(increments).all()
+    assert numpy.abs(numpy.std(increments[numpy.array([0, 1, 3])], axis=1) - 1).max() < 0.02
+    assert numpy.abs(numpy.corrcoef(increments[numpy.array([0, 1, 3])])[numpy.triu_indices(3, 1)]).max() < 0.02
+
+
+def test_innovation_cache():
+    """ Same request reuses the cached array and least recently used entries are evicted beyond the budget """
+    model = _fine_black_scholes(8)
+    cache = InnovationCache(max_bytes=2 * 8 * 1000 * 4)
+    first = model.generate_innovations(1000, 0, cache=cache)
+    assert model.generate_innovations(1000, 0, cache=cache) is first
+    model.generate_innovations(1000, 1, cache=cache)
+    model.generate_innovations(1000, 2, cache=cache)
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'evictions': 1, 'size': 2, 'bytes': 2 * 8 * 1000 * 4}
+    assert (model.generate_innovations(1000, 0, cache=cache) == first).all()
+    assert cache.stats()['misses'] == 4
+
+    # Nothing traced is kept
+    jx.jit(lambda: model.generate_innovations(1000, 3, cache=cache))()
+    assert cache.stats()['size'] == 2
+
+
+def test_heston_qe():
+    """ QE scheme on the default coarse schedule should match the semi-analytic price across strikes """
+    heston = {'v0': 0.04, 'vbar': 0.04, 'kappa': 1.5, 'eta': 0.5, 'rho': -0.7}
+    params = {'spot': 100.0, 'rate': 0.02, 'dividend': 0.01, 'expiration': 1.0, 'smooth': 0.001, **heston}
+    pricer = Pricer(Heston, Vanilla, num_paths=32768)
+    for strike in (80.0, 100.0, 120.0):
+        exact = price_call_with_phi(HestonPhi, 100.0, strike, 0.02, 0.01, 1.0, heston)
+        mean, error = pricer.price_replicates({**params, 'strike': strike}, range(8))
+        assert abs(mean - exact) < max(4 * error, 5e-3)
+
+
+def test_heston_inexact_expiration():
+    """ Expiries not exact in single precision must not add a zero length step, which Heston passes through """
+    heston = {'v0': 0.04, 'vbar': 0.04, 'kappa': 1.5, 'eta': 0.5, 'rho': -0.7}
+    params = {'spot': 100.0, 'rate': 0.02, 'dividend': 0.01, 'expiration': 0.7, 'smooth': 0.001, 'strike': 100.0,
+              **heston}
+    pricer = Pricer(Heston, Vanilla, num_paths=32768)
+    mean, error = pricer.price_replicates(params, range(8))
+    assert abs(mean - price_call_with_phi(HestonPhi, 100.0, 100.0, 0.02, 0.01, 0.7, heston)) < max(4 * error, 5e-3)
+
+    model = Heston(100.0, 0.02, 0.01, **heston)
+    state = model._initial_state(4, np.float32)
+    assert all((model._step(state, np.float32(0.0), np.ones((2, 4)))[k] == state[k]).all() for k in state)
+
+
+def test_multi_asset_black_scholes():
+    """ Log returns have the requested correlation and volatilities, and invalid correlations are rejected """
+    correlation = numpy.array([[1.0, 0.6, -0.3], [0.6, 1.0, 0.2], [-0.3, 0.2, 1.0]])
+    volatility = np.array([0.1, 0.2, 0.4])
+    model = MultiAssetBlackScholes(np.array([50.0, 100.0, 150.0]), 0.02, np.zeros(3), volatility,
+                                   np.asarray(correlation))
+    model.initialize(((1.0, None),))
+    grid = model.simulate(model.generate_innovations(100000, 0))[0]
+    assert grid['spot'].shape == (3, 100000)
+
+    returns = numpy.log(numpy.asarray(grid['spot'], dtype=float) / numpy.array([[50.0], [100.0], [150.0]]))
+    assert numpy.abs(numpy.corrcoef(returns) - correlation).max() < 0.01
+    assert numpy.abs(returns.std(axis=1) / numpy.asarray(volatility) - 1).max() < 0.01
+
+    with pytest.raises(ValueError):
+        MultiAssetBlackScholes(np.ones(2), 0.0, np.zeros(2), np.ones(2), np.array([[1.0, 1.5], [1.5, 1.0]]))
@@ -0,0 +1,55 @@
+"""
+Tests for exported pricers
+"""
+import jax.numpy as np
+
+from flexpricer.model import BlackScholes
+from flexpricer.instrument import Vanilla
+from flexpricer.engine import Pricer
+from flexpricer import persistence
+from flexpricer.persistence import ExportStore, warm_up
+from tests import PARAMS
+
+
+def test_export_store(tmp_path):
+    """ A fresh pricer loads what another one exported and gets the same numbers """
+    strikes = np.array([95.0, 105.0])
+    exporter = Pricer(BlackScholes, Vanilla, num_paths=10000, store=ExportStore(str(tmp_path)))
+    price = exporter.compiled_price(PARAMS, 0)
+    risk = exporter.risk(PARAMS, ['spot'], [('spot', 'spot')], 'strike', strikes, 0)
+    assert exporter.store.exports == 2
+
+    store = ExportStore(str(tmp_path))
+    loader = Pricer(BlackScholes, Vanilla, num_paths=10000, store=store)
+    assert loader.compiled_price(PARAMS, 0) == price
+    moved = {**PARAMS, 'strike': 105.0}
+    assert loader.compiled_price(moved, 0) == exporter.compiled_price(moved, 0)
+    loaded = loader.risk(PARAMS, ['spot'], [('spot', 'spot')], 'strike', strikes, 0)
+    assert (loaded.first_order['spot'] == risk.first_order['spot']).all()
+    assert (store.loads, store.exports) == (2, 0)
+
+
+def test_export_per_argument_shape(tmp_path):
+    """ Another vector length needs its own export instead of the one for the first length """
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=10000, store=ExportStore(str(tmp_path)))
+    short = pricer.risk(PARAMS, ['spot'], [], 'strike', np.array([95.0, 105.0]), 0)
+    long = pricer.risk(PARAMS, ['spot'], [], 'strike', np.array([95.0, 100.0, 105.0]), 0)
+    assert pricer.store.exports == 2
+    assert long.price.shape == (3,) and abs(float(long.price[2] - short.price[1])) < 1e-5
+
+
+def test_export_per_source(tmp_path, monkeypatch):
+    """ Exports of another version of the source are not loaded """
+    Pricer(BlackScholes, Vanilla, num_paths=10000, store=ExportStore(str(tmp_path))).compiled_price(PARAMS, 0)
+    monkeypatch.setattr(persistence, 'source_hash', lambda: 'changed')
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=10000, store=ExportStore(str(tmp_path)))
+    pricer.compiled_price(PARAMS, 0)
+    assert (pricer.store.loads, pricer.store.exports) == (0, 1)
+
+
+def test_warm_up_integer_params(tmp_path):
+    """ Products written by hand often have integer values """
+    product = {'model': 'BlackScholes', 'instrument': 'Vanilla', 'num_paths': 1000,
+               'params': {**PARAMS, 'spot': 100, 'strike': 100},
+               'risk': {'names': ['spot'], 'pairs': [['spot', 'spot']], 'vector_name': 'strike', 'vector_size': 2}}
+    assert warm_up([product], ExportStore(str(tmp_path))) == 2
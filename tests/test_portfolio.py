@@ -0,0 +1,57 @@
+"""
+Tests for pricing books on shared paths
+"""
+import numpy as np
+import pytest
+
+from flexpricer.model import BlackScholes
+from flexpricer.instrument import Vanilla, Digital, Asian, BermudanPut
+from flexpricer.engine import Pricer
+from flexpricer.portfolio import PortfolioPricer, Position
+from tests import PARAMS as VANILLA_PARAMS
+
+PARAMS = {**VANILLA_PARAMS, 'smooth': 0.5}
+
+
+def test_portfolio():
+    """ A book of one position is the standalone pricer. Larger books are checked against bumps """
+    single = PortfolioPricer(BlackScholes, [Position(Vanilla, {'strike': 95.0})], num_paths=10000).price(PARAMS, 0)
+    expected = Pricer(BlackScholes, Vanilla, num_paths=10000).compiled_price({**PARAMS, 'strike': 95.0}, 0)
+    assert abs(single.value - expected) < 1e-4
+
+    positions = [Position(Vanilla, {'strike': 95.0}, 2.0),
+                 Position(Digital, {'expiration': 0.1}, -1.0),
+                 Position(Vanilla, {'strike': 105.0, 'expiration': 0.1}, 3.0)]
+    pricer = PortfolioPricer(BlackScholes, positions, num_paths=10000)
+    result = pricer.risk(PARAMS, ['spot'], 0)
+    assert abs(result.prices[0] - expected) < 0.3
+    assert abs(result.value - np.dot(result.prices, [2.0, -1.0, 3.0])) < 1e-3
+
+    bumped = pricer.price({**PARAMS, 'spot': 100.01}, 0)
+    assert abs((bumped.value - result.value) / 0.01 - result.greeks['spot']) < 1e-2
+
+
+def test_path_dependent_position():
+    """ Books do not carry path statistics, so path dependent positions are rejected up front """
+    with pytest.raises(ValueError, match='path statistics'):
+        PortfolioPricer(BlackScholes, [Position(Asian)], num_paths=1000).price(PARAMS, 0)
+
+
+def test_bermudan_position():
+    """ Bermudans without fitted coefficients regress per position inside the book """
+    params = {**PARAMS, 'expiration': 1.0, 'coefficients': None}
+    positions = [Position(BermudanPut, {'strike': 100.0}), Position(BermudanPut, {'strike': 105.0}, 2.0)]
+    result = PortfolioPricer(BlackScholes, positions, num_paths=10000).price(params, 0)
+    pricer = Pricer(BlackScholes, BermudanPut, num_paths=10000)
+    expected = [pricer.compiled_price({**params, 'strike': strike}, 0) for strike in (100.0, 105.0)]
+    assert np.abs(result.prices - expected).max() < 1e-3
+
+
+def test_position_settings():
+    """ Positions with other settings are priced in their own group """
+    params = {**PARAMS, 'expiration': 1.0}
+    positions = [Position(BermudanPut), Position(BermudanPut, settings={'degree': 1})]
+    result = PortfolioPricer(BlackScholes, positions, num_paths=10000).price(params, 0)
+    expected = [Pricer(BlackScholes, BermudanPut, num_paths=10000, settings=settings).compiled_price(params, 0)
+                for settings in ({}, {'degree': 1})]
+    assert np.abs(result.prices - expected).max() < 1e-3 and abs(expected[0] - expected[1]) > 1e-3
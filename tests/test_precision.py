@@ -0,0 +1,66 @@
+"""
+Tests for precision policies
+"""
+from typing import Dict
+import numpy
+import pytest
+import jax as jx
+import jax.numpy as np
+
+from flexpricer.model import BlackScholes
+from flexpricer.instrument import Vanilla
+from flexpricer.engine import Pricer
+from flexpricer.precision import Precision, SINGLE, PAIRWISE, MIXED, DOUBLE, pairwise_sum
+from tests import PARAMS
+
+
+def test_pairwise_sum():
+    values = numpy.random.default_rng(0).normal(size=(3, 1001))
+    assert numpy.allclose(pairwise_sum(np.asarray(values)), values.sum(axis=-1), atol=1e-4)
+
+
+def test_precision_policy():
+    """ Same paths under every float32 policy. Wide accumulation gives float64 prices without enabling x64 globally """
+    prices = {}
+    for precision in (SINGLE, PAIRWISE, MIXED):
+        pricer = Pricer(BlackScholes, Vanilla, num_paths=65536, precision=precision)
+        price = pricer.compiled_price(PARAMS, 0)
+        assert price.dtype == (numpy.float64 if precision is MIXED else numpy.float32)
+        prices[precision] = float(price)
+        assert abs(float(pricer.unit_price(PARAMS, 0)) - prices[precision]) < 1e-4
+    assert abs(prices[MIXED] - prices[SINGLE]) < 1e-4
+    assert abs(prices[PAIRWISE] - prices[SINGLE]) < 1e-4
+    assert not jx.config.jax_enable_x64
+
+    with pytest.raises(ValueError, match='Unknown path dtype'):
+        Precision('float16')
+
+
+def _pathwise_gamma(innovations: np.ndarray, params: Dict[str, float]) -> float:
+    """ Pathwise gamma of the smoothed call on the same innovations, in float64 """
+    z = numpy.asarray(innovations, dtype=float)[0, 0]
+    t, sig = params['expiration'], params['volatility']
+    growth = numpy.exp((params['rate'] - params['dividend'] - sig ** 2 / 2) * t + sig * numpy.sqrt(t) * z)
+    diff = params['spot'] * growth - params['strike']
+    constant = 6 / params['smooth']
+    tanh = numpy.tanh(constant * diff)
+    second = constant * (1 - constant * diff * tanh) * (1 - tanh ** 2)
+    return float(numpy.exp(-params['rate'] * t) * numpy.mean(second * growth ** 2))
+
+
+def test_gamma_precision():
+    """
+    Gamma of every policy against a float64 evaluation of the estimator on its own paths. Accumulation policies act on
+    path averages, while the rounding of gamma comes from float32 path arithmetic, so only float64 paths improve it
+    """
+    params = {**PARAMS, 'smooth': 1.0}
+    errors = {}
+    for precision in (SINGLE, PAIRWISE, MIXED, DOUBLE):
+        pricer = Pricer(BlackScholes, Vanilla, num_paths=65536, precision=precision)
+        with precision.scope():
+            exact = _pathwise_gamma(pricer.draw_innovations(pricer.initialized_model(params), 0), params)
+        result = pricer.risk(params, [], [('spot', 'spot')], 'strike', np.array([params['strike']]), 0)
+        errors[precision] = abs(float(result.second_order[('spot', 'spot')][0]) / exact - 1)
+    assert all(errors[precision] < 1e-4 for precision in (SINGLE, PAIRWISE, MIXED))
+    assert errors[PAIRWISE] <= errors[SINGLE] and errors[MIXED] <= errors[SINGLE]
+    assert errors[DOUBLE] < 1e-10 and errors[DOUBLE] < errors[SINGLE] / 1000
@@ -0,0 +1,44 @@
+"""
+Tests for scenario and ladder risk
+"""
+import numpy
+import pytest
+
+from flexpricer.model import BlackScholes
+from flexpricer.instrument import Vanilla
+from flexpricer.engine import Pricer
+from flexpricer.scenario import ScenarioEngine
+from flexpricer.precision import MIXED
+from tests import PARAMS
+
+
+def test_scenario_grid():
+    """ Every grid point matches compiled_price on the same seed, whatever the batch size """
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=4096)
+    axes = {'spot': [80.0, 100.0, 120.0], 'volatility': [0.1, 0.2, 0.3], 'expiration': [0.2, 0.25]}
+    # Budget of 4 scenarios per batch, so the 18 points run in 5 batches
+    scenario_bytes = pricer.bytes_per_path(pricer.initialized_model(PARAMS), 1) * 4096
+    engine = ScenarioEngine(pricer, max_bytes=4 * scenario_bytes)
+    result = engine.grid(PARAMS, axes, 0, names=['strike'])
+    assert result.price.shape == result.greeks['strike'].shape == (3, 3, 2)
+
+    for spot, volatility, expiration in [(80.0, 0.3, 0.2), (120.0, 0.1, 0.25), (100.0, 0.2, 0.25)]:
+        point = {'spot': spot, 'volatility': volatility, 'expiration': expiration}
+        assert abs(result.at(**point) - pricer.compiled_price({**PARAMS, **point}, 0)) < 1e-4
+    assert (numpy.diff(result.price, axis=0) > 0).all()
+    assert (result.greeks['strike'] <= 0).all()
+
+    listed = ScenarioEngine(pricer).scenarios(PARAMS, [{'spot': 80.0, 'volatility': 0.3, 'expiration': 0.2},
+                                                       {'spot': 120.0}], 0)
+    assert abs(listed.price[0] - result.at(spot=80.0, volatility=0.3, expiration=0.2)) < 1e-5
+    assert abs(listed.price[1] - pricer.compiled_price({**PARAMS, 'spot': 120.0}, 0)) < 1e-4
+
+    with pytest.raises(ValueError, match='at least one scenario'):
+        ScenarioEngine(pricer).scenarios(PARAMS, [], 0)
+
+
+def test_mixed_precision_scenarios():
+    """ Overrides follow the float32 paths when x64 is on for float64 accumulation """
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=4096, precision=MIXED)
+    result = ScenarioEngine(pricer).grid(PARAMS, {'rate': [0.0, 0.05]}, 0)
+    assert abs(result.at(rate=0.05) - float(pricer.compiled_price({**PARAMS, 'rate': 0.05}, 0))) < 1e-4
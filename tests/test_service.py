@@ -0,0 +1,34 @@
+"""
+Tests for the micro-batching pricing service
+"""
+import asyncio
+
+from flexpricer.model import BlackScholes
+from flexpricer.instrument import Vanilla, Digital
+from flexpricer.engine import Pricer
+from flexpricer.service import PricingService
+from tests import PARAMS
+
+
+def test_pricing_service():
+    """ Concurrent requests are coalesced by signature and each caller gets its own result """
+    strikes = [90.0 + idx for idx in range(20)]
+
+    async def client():
+        async with PricingService(num_paths=4096, max_batch_size=16, max_wait=0.05) as service:
+            requests = [service.price(BlackScholes, Vanilla, {**PARAMS, 'strike': strike}) for strike in strikes]
+            requests.append(service.risk(BlackScholes, Digital, PARAMS, ['spot']))
+            results = await asyncio.gather(*requests)
+            return results, service.stats()
+
+    results, stats = asyncio.run(client())
+    # 16 Vanilla requests fill a batch, the other 4 and the Digital one go when their wait is over
+    assert stats['batch_sizes'] == {1: 1, 4: 1, 16: 1}
+    assert stats['queue_depth'] == 0 and stats['max_queue_depth'] == 16
+
+    pricer = Pricer(BlackScholes, Vanilla, num_paths=4096)
+    for strike, price in zip(strikes, results[:-1]):
+        assert abs(price - pricer.compiled_price({**PARAMS, 'strike': strike}, 0)) < 1e-4
+    price, greeks = results[-1]
+    assert abs(price - Pricer(BlackScholes, Digital, num_paths=4096).compiled_price(PARAMS, 0)) < 1e-4
+    assert greeks['spot'] > 0